@@ -1,50 +1,108 @@
 import streamlit as st
 import pandas as pd
 import logging
-from src.data_loader import load_data, preprocess_data
+from src.data_loader import load_data, prepare_data
+from src import data_store
 from src.gemini_handler import GeminiHandler
 from src.llm_handler import LLMHandler
 from src.search_engine import SearchEngine
+from src.query_parser import known_locations
+from src.analysis_pool import AnalysisPool
+from src.code_cache import AnalysisCodeCache
+from src.aggregate_cube import MEASURE_COLUMNS, SALE_DATE_COLUMN, AggregateCube
+from src.prompt_builder import CORE_COLUMNS, KEYWORD_COLUMNS, AnalysisPromptBuilder
+from src.bulk_encoder import TEXT_COLUMNS
+from src.embedding_cache import ID_COLUMNS, UPDATED_COLUMN
+from src.filters import LOCATION_COLUMNS, NUMERIC_FIELDS, PROPERTY_TYPE_COLUMNS, TENURE_COLUMNS
+from src.metrics import metrics
 import os
+import threading
 
+# logging.DEBUG also logs every Gemini prompt and the generated code
+LOG_LEVEL = logging.INFO
 # Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 
 st.set_page_config(page_title="Dynamic Property Analysis and Search", layout="wide")
 
 st.title("Dynamic Property Analysis and Search")
 
 # Load and preprocess data
-@st.cache_data
-def load_and_preprocess_data():
+DATA_FILE = 'data/property_data.csv'
+STORE_FILE = data_store.DEFAULT_STORE_PATH
+# 'exact', 'ivf', or 'float16'/'int8' for compact embeddings with exact re-ranking
+# (float16 queries are several times slower than exact; int8 is not)
+SEARCH_INDEX = 'exact'
+# Analysis charts are rendered in memory as 'png' or 'svg'
+FIGURE_FORMAT = 'png'
+# JSON-lines file each timed pipeline stage is appended to; None to keep metrics in memory only
+METRICS_EVENTS_FILE = None
+# Where the sidebar's "Profile queries" option writes its cProfile .prof files
+PROFILE_DIR = 'profiles'
+
+# Columns (or column families, e.g. 'secondary_area' for 'secondary_area.epc')
+# read from the data store: those search, the filters, the aggregate cube and
+# the embedding cache use, plus those analysis prompts are built around.
+# Generated analysis code only sees loaded columns; None loads every column.
+EXPECTED_COLUMNS = ['date_created.date', 'latest_sale_price', 'latest_sale_date', 'secondary_latest_sale_date.lr.date']
+LOAD_COLUMNS = sorted(
+    set(EXPECTED_COLUMNS + TEXT_COLUMNS + ID_COLUMNS + [UPDATED_COLUMN, SALE_DATE_COLUMN, 'lat', 'long'])
+    | set(LOCATION_COLUMNS + PROPERTY_TYPE_COLUMNS + TENURE_COLUMNS + CORE_COLUMNS)
+    | {c for columns in NUMERIC_FIELDS.values() for c in columns}
+    | set(MEASURE_COLUMNS.values())
+    | {c for columns in KEYWORD_COLUMNS.values() for c in columns}
+)
+
+metrics.events_path = METRICS_EVENTS_FILE
+
+def load_store():
+    columns = None if LOAD_COLUMNS is None else data_store.matching_columns(STORE_FILE, LOAD_COLUMNS)
+    return data_store.load(STORE_FILE, columns)
+
+def store_source(df):
+    # (path, columns) analysis workers load df from, or None if it didn't come from the store
+    if data_store.is_stale(DATA_FILE, STORE_FILE):
+        return None
+    return STORE_FILE, list(df.columns)
+
+# One frame for every session and rerun, memory-mapped from the store rather
+# than copied per session as st.cache_data would. It is shared, so treat it as
+# read-only: modify a df.copy(deep=False) instead.
+@st.cache_resource(max_entries=1)
+def load_and_preprocess_data(data_version=None):
+    # data_version only keys the cache, so a changed file is picked up on the next run
     try:
-        file_path = 'data/property_data.csv'
+        file_path = DATA_FILE
         if not os.path.isfile(file_path):
             raise FileNotFoundError(f"The file {file_path} does not exist.")
         
-        # Load the data
-        df = pd.read_csv(file_path)
-        
+        use_store = not data_store.is_stale(file_path, STORE_FILE)
+        with metrics.span('data_load'):
+            if use_store:
+                # Typed columnar copy, already preprocessed
+                df = load_store()
+            else:
+                # Load the data
+                df = pd.read_csv(file_path)
+
         # Check if the DataFrame is empty
         if df.empty:
             raise ValueError("The data file is empty.")
         
         # Check for expected columns
-        expected_columns = [
-            'date_created.date', 'latest_sale_price', 'latest_sale_date',
-            'secondary_latest_sale_date.lr.date'
-        ]
-        for col in expected_columns:
+        for col in EXPECTED_COLUMNS:
             if col not in df.columns:
                 st.warning(f"Expected column '{col}' is missing in the data.")
 
-        df = preprocess_data(df)
-        df['lease_term'] = df['lease_term'].astype(str)  # Convert lease_term to string
-
-        # Ensure date columns are in datetime format
-        date_columns = [col for col in df.columns if 'date' in col]
-        for col in date_columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
+        if not use_store:
+            with metrics.span('preprocess'):
+                df = prepare_data(df)
+            try:
+                data_store.write(df, STORE_FILE)
+                # Read back, projected and memory-mapped, so even the first run shares pages
+                df = load_store()
+            except ImportError as e:
+                logging.warning(f"Not writing the columnar data store: {str(e)}")
 
         return df
     except FileNotFoundError as e:
@@ -57,7 +115,8 @@ def load_and_preprocess_data():
         st.error(f"Unexpected error: {str(e)}")
         return None
 
-df = load_and_preprocess_data()
+data_version = os.path.getmtime(DATA_FILE) if os.path.isfile(DATA_FILE) else None
+df = load_and_preprocess_data(data_version)
 
 if df is not None:
     st.sidebar.success(f"Data loaded successfully. Shape: {df.shape}")
@@ -69,9 +128,18 @@ else:
 @st.cache_resource
 def initialize_handlers():
     try:
-        gemini_handler = GeminiHandler(st.secrets["GEMINI_API_KEY"])
+        # Workers start from a forkserver when df came from the store. Otherwise
+        # they are forked, so the first ones are started before the embedding
+        # model's threads; later restarts still fork a threaded process.
+        analysis_pool = AnalysisPool(df, figure_format=FIGURE_FORMAT, store=store_source(df))
+        gemini_handler = GeminiHandler(st.secrets["GEMINI_API_KEY"], locations=known_locations(df))
+        gemini_handler.analysis_pool = analysis_pool
         llm_handler = LLMHandler()
-        search_engine = SearchEngine(df, llm_handler)
+        search_engine = SearchEngine(df, llm_handler, data_version=data_version, index_kind=SEARCH_INDEX)
+        gemini_handler.code_cache = AnalysisCodeCache(llm_handler=llm_handler)
+        gemini_handler.aggregate_cube = AggregateCube(df)
+        gemini_handler.prompt_builder = AnalysisPromptBuilder(df, llm_handler=llm_handler)
+        metrics.register('pipeline', gemini_handler.pipeline_stats)
         return gemini_handler, llm_handler, search_engine
     except Exception as e:
         st.error(f"Error initializing handlers or search engine: {str(e)}")
@@ -79,69 +147,88 @@ def initialize_handlers():
 
 gemini_handler, llm_handler, search_engine = initialize_handlers()
 
+@st.cache_resource
+def data_reload_lock():
+    # Shared by every session, so only one of them reloads changed data
+    return threading.Lock()
+
 if None in (gemini_handler, llm_handler, search_engine):
     st.stop()
 
+if search_engine.data_version != data_version:
+    with data_reload_lock(), st.spinner("Data changed, re-embedding updated properties..."):
+        # Another session may have finished the reload while this one waited.
+        # The search engine goes last, since its data_version marks the reload done.
+        if search_engine.data_version != data_version:
+            gemini_handler.local_interpreter.locations = known_locations(df)
+            gemini_handler.analysis_pool.reload(df, store_source(df))
+            gemini_handler.aggregate_cube.refresh(df)
+            gemini_handler.prompt_builder.reload(df)
+            search_engine.reload(df, data_version)
+
 st.sidebar.success("Handlers and search engine initialized successfully.")
+st.sidebar.caption(f"Search index memory: {search_engine.memory_stats()}")
 
 # Main query input
 query = st.text_input("Enter your query (e.g., 'Find 2BHK houses in London' or 'Analyze property prices over time'):")
+profile_queries = st.sidebar.checkbox("Profile queries", help=f"Run each query under cProfile and save the profile to {PROFILE_DIR}/")
 
 if query:
     try:
-        # Use Gemini to interpret the query
-        with st.spinner("Interpreting your query..."):
-            interpretation = gemini_handler.interpret_query(query)
-        
-        st.subheader("Query Interpretation")
-        st.json(interpretation)
-        
-        if interpretation['intent'] == 'search':
-            # Perform property search
-            with st.spinner("Searching for properties..."):
-                results = search_engine.search(query, interpretation['parameters'])
-            
-            st.subheader("Search Results")
-            if not results.empty:
-                st.dataframe(results)
-            else:
-                st.info("No matching properties found.")
-        
-        elif interpretation['intent'] == 'analysis':
-            # Generate and execute analysis
-            with st.spinner("Generating and executing analysis..."):
-                result = gemini_handler.generate_and_execute_analysis(query, interpretation['parameters'], df)
-                
-                st.subheader("Analysis Result")
-
-                # Display the plot images
-                def display_images_from_folder(folder_path):
-                    # List all files in the folder
-                    image_files = [f for f in os.listdir(folder_path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))]
-                    
-                    # Sort files to ensure consistent order
-                    image_files.sort()
-                    
-                    # Check if there are images to display
-                    if not image_files:
-                        st.write("No images found in the folder.")
-                        return
-                    
-                    # Display each image
-                    # for image_file in image_files:
-                    #     image_path = os.path.join(folder_path, image_file)
-                    #     st.image(image_path, caption=image_file, use_column_width=True)
-
-                    image_file = 'result.png'
-                    image_path = os.path.join(folder_path, image_file)
-                    st.image(image_path, caption=image_file, use_column_width=True)
-
-                # Set the folder path where your images are stored
-                folder_path = 'graphs/'  # Change this to your folder path
-
-                # Display the images
-                display_images_from_folder(folder_path)
-                # st.image(graphs/result.png, caption=image_file, use_column_width=True)
-    
+        with metrics.profile('query', enabled=profile_queries, directory=PROFILE_DIR) as profile:
+            # Use Gemini to interpret the query
+            with st.spinner("Interpreting your query..."):
+                interpretation = gemini_handler.interpret_query(query)
+
+            st.subheader("Query Interpretation")
+            st.json(interpretation)
+            st.sidebar.caption(f"Interpretation cache: {gemini_handler.interpretation_stats()}")
+
+            if interpretation['intent'] == 'search':
+                # Perform property search
+                with st.spinner("Searching for properties..."):
+                    results = search_engine.search(query, interpretation['parameters'])
+
+                st.subheader("Search Results")
+                with metrics.span('display'):
+                    if not results.empty:
+                        st.dataframe(results)
+                    else:
+                        st.info("No matching properties found.")
+
+            elif interpretation['intent'] == 'analysis':
+                # Generate and execute analysis
+                with st.spinner("Generating and executing analysis..."):
+                    result = gemini_handler.generate_and_execute_analysis(query, interpretation['parameters'], df)
+
+                    st.subheader("Analysis Result")
+                    st.sidebar.caption(f"Analysis code cache: {gemini_handler.code_cache.stats()}")
+                    st.sidebar.caption(f"Aggregate cube: {gemini_handler.aggregate_cube.stats()}")
+                    st.sidebar.caption(f"Render cache: {gemini_handler.analysis_pool.render_cache.stats()}")
+                    st.sidebar.caption(f"Analysis prompts: {gemini_handler.analysis_prompt_stats()}")
+                    with metrics.span('display'):
+                        if result.get('output'):
+                            st.text(result['output'])
+
+                        # Figures come back in memory, so concurrent sessions never share a file
+                        for figure in result.get('figures', []):
+                            if result.get('figure_format') == 'svg':
+                                st.image(figure.decode(), use_column_width=True)
+                            else:
+                                st.image(figure, use_column_width=True)
+
+        if profile.get('path'):
+            with st.expander(f"Profile ({profile['seconds']}s, saved to {profile['path']})"):
+                st.text(profile['top'])
+
     except Exception as e:
         st.error(f"Error processing your query: {str(e)}")
+
+# Per-stage latencies since the app started, across every session
+with st.sidebar.expander("Performance"):
+    summary = metrics.summary()
+    if summary['stages']:
+        st.dataframe(pd.DataFrame(summary['stages']).T[['count', 'p50_ms', 'p99_ms', 'mean_ms', 'errors']])
+    if summary['counters']:
+        st.json(summary['counters'])
+    st.download_button("Export metrics (Prometheus)", metrics.prometheus(), file_name='dpas_metrics.prom', mime='text/plain')
@@ -0,0 +1,175 @@
+import json
+import re
+import sys
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+
+from src.bulk_encoder import DEFAULT_CHUNK_SIZE, TEXT_COLUMNS, BulkEncoder, property_texts
+from src.query_parser import ANALYSIS_WORDS, normalise_query
+
+# Rough characters per token, for the usage numbers the fake reports
+CHARS_PER_TOKEN = 4
+
+_INTERPRET_QUERY = re.compile(r'Interpret the following user query[^"]*"(.*)"')
+_ANALYSIS_QUERY = re.compile(r'analysis of UK property data: "(.*)"')
+
+# Code returned for analysis prompts, picked by the first matching word in the query
+ANALYSIS_CODE = [
+    (('trend', 'trends', 'year', 'years', 'time', 'over'), """```python
+prices = df[df['latest_sale_price'] > 0]
+yearly = prices.groupby(prices['latest_sale_date'].dt.year)['latest_sale_price'].mean()
+print(yearly.round(0).to_string())
+yearly.plot(kind='line', marker='o', title='Average sale price by year')
+```"""),
+    (('relate', 'correlation', 'against', 'versus', 'vs'), """```python
+sample = df[(df['latest_sale_price'] > 0) & (df['latest_price_ppsqft'] > 0)]
+print(sample[['latest_sale_price', 'latest_price_ppsqft']].corr().round(3).to_string())
+sample = sample.sample(min(len(sample), 5000), random_state=0)
+plt.scatter(sample['latest_price_ppsqft'], sample['latest_sale_price'], s=2)
+plt.xlabel('Price per sq ft')
+plt.ylabel('Sale price')
+```"""),
+    (('distribution', 'spread', 'histogram'), """```python
+prices = df.loc[df['latest_sale_price'] > 0, 'latest_sale_price']
+print(prices.describe().round(0).to_string())
+prices.clip(upper=prices.quantile(0.99)).plot(kind='hist', bins=50, title='Sale price distribution')
+```"""),
+]
+DEFAULT_ANALYSIS_CODE = """```python
+prices = df[df['latest_sale_price'] > 0]
+by_town = prices.groupby('town', observed=True)['latest_sale_price'].median().sort_values()
+print(by_town.round(0).to_string())
+by_town.plot(kind='barh', title='Median sale price by town')
+```"""
+
+
+class FakeUsage:
+    def __init__(self, prompt, text):
+        self.prompt_token_count = len(prompt) // CHARS_PER_TOKEN
+        self.candidates_token_count = len(text) // CHARS_PER_TOKEN
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class FakePart:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, prompt, text):
+        self.text = text
+        self.parts = [FakePart(text)]
+        self.usage_metadata = FakeUsage(prompt, text)
+
+
+class FakeTokenCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+class FakeGenerativeModel:
+    # Stands in for genai.GenerativeModel: answers interpretation prompts with
+    # a JSON intent and analysis prompts with fixed pandas/matplotlib code,
+    # after sleeping `latency` seconds. The same prompt always gets the same
+    # response, so runs are comparable between commits.
+
+    latency = 0.0
+
+    def __init__(self, model_name='gemini-pro', **kwargs):
+        self.model_name = model_name
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+        return FakeResponse(prompt, self.respond(prompt))
+
+    def count_tokens(self, prompt):
+        return FakeTokenCount(len(prompt) // CHARS_PER_TOKEN)
+
+    def respond(self, prompt):
+        match = _INTERPRET_QUERY.search(prompt)
+        if match:
+            words = set(normalise_query(match.group(1)).split())
+            intent = 'analysis' if words & ANALYSIS_WORDS else 'search'
+            return '```json\n' + json.dumps({'intent': intent, 'parameters': {}}) + '\n```'
+        match = _ANALYSIS_QUERY.search(prompt)
+        words = set(normalise_query(match.group(1)).split()) if match else set()
+        for keywords, code in ANALYSIS_CODE:
+            if words & set(keywords):
+                return code
+        return DEFAULT_ANALYSIS_CODE
+
+
+def install(latency=0.0):
+    # Points google.generativeai at the fake, installing a stub module when the
+    # real package is missing. Call before src.gemini_handler is imported.
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        google = sys.modules.setdefault('google', types.ModuleType('google'))
+        genai = types.ModuleType('google.generativeai')
+        google.generativeai = genai
+        sys.modules['google.generativeai'] = genai
+    FakeGenerativeModel.latency = latency
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = FakeGenerativeModel
+    return genai
+
+
+class HashingModel:
+    # Deterministic stand-in for the sentence-transformers model: words are
+    # hashed into a fixed number of signed buckets and the vector normalised
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in str(text).lower().split():
+                h = zlib.crc32(word.encode())
+                embeddings[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms > 0, norms, 1)
+        return embeddings[0] if single else embeddings
+
+
+class HashingEncoder:
+    # LLMHandler's interface over HashingModel, returning numpy arrays instead
+    # of tensors. Property texts still go through BulkEncoder, so
+    # deduplication, chunking and memory-mapped output are measured as they
+    # run in the app; only the model forward pass is replaced.
+
+    def __init__(self, dim=384, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.model_name = f'hashing-{dim}'
+        self.text_columns = TEXT_COLUMNS
+        self.model = HashingModel(dim)
+        self.bulk_encoder = BulkEncoder(self.model_name, self.model, workers=1, chunk_size=chunk_size)
+
+    def encode_query(self, query):
+        return self.model.encode(query)
+
+    def encode_queries(self, queries, batch_size=64):
+        return self.model.encode(list(queries), batch_size=batch_size)
+
+    def property_texts(self, df):
+        return property_texts(df, self.text_columns).tolist()
+
+    def encode_properties(self, df, convert_to_tensor=False, out_path=None):
+        return self.bulk_encoder.encode(property_texts(df, self.text_columns), out_path=out_path)
+
+    def search_properties(self, query_embedding, property_embeddings, top_k=5, candidates=None):
+        return property_embeddings.search(np.asarray(query_embedding), top_k, candidates=candidates).tolist()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data_loader import parse_lease_term, prepare_data, optimize_dtypes
+
+LEASE_TERMS = ['99 years', '125 years', '999 years', 'Freehold', None]
+
+
+def synthetic_frame(rows, seed=0):
+    # Shaped like the flattened export: ISO timestamps, sparse numbers, text lease terms
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('1995-01-01T00:00:00.000')
+    offsets = rng.integers(0, 30 * 365 * 24 * 3600 * 1000, rows).astype('timedelta64[ms]')
+    timestamps = pd.Series(np.datetime_as_string(start + offsets, unit='ms')) + 'Z'
+    timestamps[rng.random(rows) < 0.05] = None
+
+    prices = rng.integers(50000, 2000000, rows).astype(np.float64)
+    prices[rng.random(rows) < 0.1] = np.nan
+    lease_terms = pd.Series(np.array(LEASE_TERMS, dtype=object)[rng.integers(0, len(LEASE_TERMS), rows)])
+    return pd.DataFrame({
+        'date_created.date': timestamps,
+        'date_updated.date': timestamps.sample(frac=1, random_state=seed).to_numpy(),
+        'latest_sale_date': timestamps.str.slice(0, 10),
+        'latest_sale_price': prices,
+        'bedrooms': rng.integers(0, 7, rows).astype(np.float64),
+        'latitude': rng.uniform(50.0, 55.0, rows),
+        'longitude': rng.uniform(-5.0, 1.0, rows),
+        'district': pd.Series(rng.integers(0, 300, rows)).map(lambda i: f"District {i}"),
+        'lease_term': lease_terms,
+    })
+
+
+def legacy_prepare_data(df):
+    # preprocess_data and prepare_data as they were before vectorisation
+    for col in ['date_created', 'date_updated', 'latest_sale_date']:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    numeric_columns = df.select_dtypes(include=['float64', 'int64']).columns
+    df[numeric_columns] = df[numeric_columns].fillna(0)
+    if 'lease_term' in df.columns:
+        df['lease_term'] = df['lease_term'].apply(parse_lease_term)
+        df['lease_term'] = df['lease_term'].astype(str)
+    for col in [col for col in df.columns if 'date' in col]:
+        df[col] = pd.to_datetime(df[col], errors='coerce')
+    return optimize_dtypes(df)
+
+
+def check_equivalent(legacy, current):
+    assert list(legacy.columns) == list(current.columns)
+    for col in legacy.columns:
+        a, b = legacy[col], current[col]
+        if pd.api.types.is_datetime64_any_dtype(a):
+            a = a.dt.tz_localize('UTC') if a.dt.tz is None else a
+            assert a.astype('datetime64[us, UTC]').equals(b.astype('datetime64[us, UTC]')), col
+        else:
+            assert a.astype(object).equals(b.astype(object)), col
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the legacy and vectorised preprocessing pipelines.")
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--json', action='store_true', help="Print the result as one JSON object")
+    args = parser.parse_args(argv)
+
+    df = synthetic_frame(args.rows)
+    legacy, legacy_seconds = timed(legacy_prepare_data, df.copy())
+    current, current_seconds = timed(prepare_data, df.copy())
+    check_equivalent(legacy, current)
+
+    result = {
+        'rows': args.rows,
+        'legacy_seconds': round(legacy_seconds, 3),
+        'vectorised_seconds': round(current_seconds, 3),
+        'speedup': round(legacy_seconds / current_seconds, 2),
+    }
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"{args.rows} rows: legacy {legacy_seconds:.2f}s, vectorised {current_seconds:.2f}s "
+              f"({result['speedup']}x faster)")
+
+
+if __name__ == '__main__':
+    main()
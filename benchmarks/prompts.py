@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from src.data_loader import is_date_column, prepare_data
+from src.prompt_builder import AnalysisPromptBuilder
+
+# The export's columns, as they were hard-coded in the analysis prompt
+LEGACY_COLUMNS = 'address\tpostcode\tstreet\tlat\tlong\tdistrict\tcc\tactive\tsector\ttown\tbuilding_number\tdistrict_name\tsector_name\tupdate_required\tbuilding_name\tsub_building_name\tlatest_sale_price\tlatest_price_ppsqft\tepc_reference\tepc_date\tavm\tavm_accuracy\tlatest_new_build\tlatest_tenure\tlatest_lr_reference\tsnl\thabitable_rooms\ttci_avm\ttci_accuracy\tfloor_level\tlease_term\tlocked\tregion\tpaf_postcode\tpaf_postcode_type\tpaf_udprn\tpaf_address_key\tpaf_locality_key\tpostcode_area\trpp_key\twater_proximity_400\tfloor_level_discrete\tfuel_source\theating\twalls\tlisted_building_grade\troof_type\ttree_proximity_10\ttree_proximity_5\tage_band\t_id.oid\tuprn.numberLong\tmain_reference.numberLong\tsecondary_bedrooms.listings.numberDouble\tsecondary_bedrooms.dvm\tsecondary_bathrooms.listings.numberDouble\tsecondary_bathrooms.dvm\tsecondary_receptions.listings.numberDouble\tsecondary_receptions.dvm\tsecondary_area.listings.numberDouble\tsecondary_area.epc\tsecondary_area.dvm\tsecondary_property_type.epc\tsecondary_property_type.lr\tsecondary_property_type.listings.numberDouble\tsecondary_property_type.dvm\tsecondary_num_floors.epc.numberDouble\tsecondary_num_floors.dvm.numberDouble\tsecondary_latest_sale_date.lr.date\tsecondary_latest_sale_date.listings.numberDouble\tsecondary_latest_sale_price.lr\tsecondary_latest_sale_price.listings.$numberDouble\tsecondary_new_build.listings\tsecondary_new_build.lr\tsecondary_tenure.listings\tsecondary_tenure.lr\tcoordinates.type\tcoordinates.coordinates\tlatest_sale_date\tepc_values.current_energy_efficiency\tepc_values.potential_energy_efficiency\tepc_values.environment_impact_current\tepc_values.environment_impact_potential\tdate_created.date\tdate_updated.date\tstreet_reference.numberLong\tbuilding_reference.numberLong\tsecondary_sub_property_type.dvm.numberDouble\tsecondary_sub_property_type.epc.numberDouble\tsecondary_sub_property_type.listings.numberDouble'
+
+QUERIES = [
+    "Analyze property price trends in Birmingham over the last 5 years",
+    "Compare average prices of 1BHK vs 2BHK apartments in Liverpool",
+    "How does energy efficiency relate to sale price?",
+    "Show the distribution of lease terms for leasehold flats",
+    "Which districts have the most new build sales per year?",
+    "Plot price per square foot against floor area by property type",
+]
+TOWNS = ['London', 'Birmingham', 'Liverpool', 'Leeds', 'Bristol', 'Manchester']
+WORDS = ['flat', 'house', 'terraced', 'detached', 'Freehold', 'Leasehold', 'gas', 'electric', 'brick', 'tile']
+
+
+def legacy_prompt(query, df):
+    # The analysis prompt as it was before AnalysisPromptBuilder
+    with warnings.catch_warnings():
+        # to_json's default date format is deprecated in newer pandas
+        warnings.simplefilter('ignore')
+        sample = df.head().to_json()
+    return f"""
+        Generate Python code to analyze the following data:
+        {sample}
+
+        The code should perform the analysis based on the query: "{query}"
+        Use print statements to output any relevant analysis results or insights.
+        Ensure that the code includes the necessary imports and saves the plots to the 'graphs' directory.
+        If user want to analyze by using the time in prompts plot the graph then by extracting only years from the columns and the data in column where you need to fetch year, date or anything is of this format %Y-%m-%dT%H:%M:%S.%fZ.
+        Like I tell you if you want to extract year so use like this df['latest_sale_year'] = pd.to_datetime(df['latest_sale_date'], format='%Y-%m-%dT%H:%M:%S.%fZ').dt.year .
+        my data is on location so
+        df = pd.read_csv('data/property_data.csv') 
+        please make sure that if u need data in json format it is present in location 'data/properties.json'
+        and if u need data in csv format it is in location 'data/property_data.csv'
+        so you can write this.
+        Always save the image output with the name result.png as in graphs folder like plt.savefig('graphs/result.png') if result.png already exist overwrite it.
+        these are the columns name in my csv file ({LEGACY_COLUMNS}
+)
+        """
+
+
+def synthetic_frame(rows, seed=0, columns=None):
+    # Every export column (or just `columns`) with a plausible type: ISO dates,
+    # numbers for prices, areas and counts, short strings for everything else
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('1995-01-01T00:00:00.000')
+    data = {}
+    for col in columns if columns is not None else LEGACY_COLUMNS.split('\t'):
+        if is_date_column(col) and not col.endswith('numberDouble'):
+            offsets = rng.integers(0, 30 * 365 * 24 * 3600 * 1000, rows).astype('timedelta64[ms]')
+            data[col] = pd.Series(np.datetime_as_string(start + offsets, unit='ms')) + 'Z'
+        elif col in ('town', 'district', 'region', 'district_name'):
+            data[col] = np.array(TOWNS, dtype=object)[rng.integers(0, len(TOWNS), rows)]
+        elif col in ('lat', 'long') or any(p in col for p in ('price', 'avm', 'area', 'number', 'rooms', 'proximity', 'efficiency', 'impact', 'accuracy')):
+            values = rng.uniform(0, 1000000, rows)
+            values[rng.random(rows) < 0.2] = np.nan
+            data[col] = values
+        else:
+            data[col] = np.array(WORDS, dtype=object)[rng.integers(0, len(WORDS), rows)]
+    return pd.DataFrame(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the legacy and schema-aware analysis prompts.")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--data', help="Preprocessed data to describe instead of synthetic rows")
+    parser.add_argument('--gemini', action='store_true',
+                        help="Also count tokens and time code generation with Gemini (needs GEMINI_API_KEY)")
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON lines")
+    args = parser.parse_args(argv)
+
+    if args.data:
+        from src import data_store
+        df = data_store.load_or_ingest(args.data)
+    else:
+        df = prepare_data(synthetic_frame(args.rows))
+    builder = AnalysisPromptBuilder(df)
+    model = None
+    if args.gemini:
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ['GEMINI_API_KEY'])
+        model = genai.GenerativeModel('gemini-pro')
+
+    for query in QUERIES:
+        start = time.perf_counter()
+        legacy = legacy_prompt(query, df)
+        legacy_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        compact = builder.build(query, {})
+        compact_ms = (time.perf_counter() - start) * 1000
+        result = {
+            'query': query,
+            'legacy_chars': len(legacy),
+            'compact_chars': len(compact),
+            'reduction': round(1 - len(compact) / len(legacy), 3),
+            'legacy_build_ms': round(legacy_ms, 2),
+            'compact_build_ms': round(compact_ms, 2),
+            'columns': len(builder.select_columns(query, {})),
+        }
+        if model is not None:
+            for name, prompt in (('legacy', legacy), ('compact', compact)):
+                result[f'{name}_tokens'] = model.count_tokens(prompt).total_tokens
+                start = time.perf_counter()
+                model.generate_content(prompt)
+                result[f'{name}_gemini_seconds'] = round(time.perf_counter() - start, 2)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            line = (f"{query[:50]:50}  {result['legacy_chars']:6} -> {result['compact_chars']:5} chars "
+                    f"({result['reduction']:.0%} smaller, {result['columns']} columns), "
+                    f"built in {result['compact_build_ms']:.1f}ms")
+            if model is not None:
+                line += (f", {result['legacy_tokens']} -> {result['compact_tokens']} tokens, Gemini "
+                         f"{result['legacy_gemini_seconds']}s -> {result['compact_gemini_seconds']}s")
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
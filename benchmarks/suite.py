@@ -0,0 +1,307 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import fakes, synthetic
+
+DEFAULT_SIZES = '10k,100k'
+DEFAULT_WORKDIR = os.path.join('cache', 'benchmarks')
+# A p50 this much slower, or a throughput this much lower, than the baseline is a regression
+REGRESSION_THRESHOLD = 0.1
+REPORT_VERSION = 1
+
+SEARCH_TEMPLATES = [
+    "{beds}BHK flat in {place}",
+    "{beds} bedroom house in {place}",
+    "houses under £{price}k in {place}",
+    "leasehold flats in {place}",
+    "freehold {beds} bedroom homes near {place}",
+    "family home close to good schools in {place}",
+]
+# Cycled through in order; the first three are answered by the aggregate cube,
+# the rest go through code generation (and the render cache when repeated)
+ANALYSIS_QUERIES = [
+    "average price by district",
+    "median price per sq ft per quarter",
+    "number of sales per year",
+    "How does price per square foot relate to sale price?",
+    "Show the distribution of floor area for flats and houses",
+    "Which towns have the highest median price for new builds?",
+]
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process so far; None where resource is unavailable
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def timed(samples, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def summarise(samples, items=None, unit='calls/s'):
+    # Latency percentiles over the calls, throughput as items per second of total time
+    samples = np.asarray(samples, dtype=np.float64)
+    total = float(samples.sum())
+    items = len(samples) if items is None else items
+    return {
+        'calls': len(samples),
+        'p50_ms': round(float(np.percentile(samples, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(samples, 99)) * 1000, 3),
+        'mean_ms': round(total / len(samples) * 1000, 3),
+        'total_s': round(total, 3),
+        'throughput': round(items / total, 1) if total > 0 else None,
+        'unit': unit,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def search_queries(n, seed=0):
+    rng = np.random.default_rng(seed)
+    places = [name for place in synthetic.PLACES for name in [place[0]] + place[6]]
+    return [SEARCH_TEMPLATES[rng.integers(len(SEARCH_TEMPLATES))].format(
+        beds=rng.integers(1, 5), place=places[rng.integers(len(places))], price=[250, 400, 600][rng.integers(3)])
+        for _ in range(n)]
+
+
+def make_encoder(kind, dim):
+    # The app's LLMHandler when sentence-transformers is installed (or required),
+    # otherwise the deterministic hashing encoder
+    if kind in ('auto', 'model'):
+        try:
+            from src.llm_handler import LLMHandler
+        except ImportError:
+            if kind == 'model':
+                raise
+            logging.warning("sentence-transformers is not installed, using the hashing encoder")
+        else:
+            return LLMHandler(), 'model'
+    return fakes.HashingEncoder(dim), 'hashing'
+
+
+def run_size(rows, options):
+    # Every benchmark for one dataset size. Runs in a fresh process, so peak
+    # RSS belongs to this size alone.
+    fakes.install(options['gemini_latency_ms'] / 1000)
+    from src import data_store
+    from src.aggregate_cube import AggregateCube
+    from src.analysis_pool import AnalysisPool
+    from src.data_loader import prepare_data
+    from src.embedding_cache import EmbeddingCache
+    from src.gemini_handler import GeminiHandler
+    from src.metrics import metrics
+    from src.prompt_builder import AnalysisPromptBuilder
+    from src.query_parser import known_locations
+    from src.search_engine import SearchEngine
+
+    metrics.reset()
+    report = {'rows': rows, 'benchmarks': {}, 'skipped': {}}
+    benchmarks = report['benchmarks']
+    path = synthetic.dataset_path(options['workdir'], rows, options['seed'], options['schema'])
+    if not os.path.isfile(path):
+        start = time.perf_counter()
+        synthetic.write_csv(path, rows, options['seed'], options['schema'])
+        report['generate_s'] = round(time.perf_counter() - start, 2)
+    report['file_mb'] = round(os.path.getsize(path) / 1e6, 1)
+    tmpdir = tempfile.mkdtemp(prefix='dpas-bench-', dir=options['workdir'])
+    pool = None
+    try:
+        # load_and_preprocess_data without a data store: read the CSV, then prepare_data
+        read, prepare = [], []
+        for _ in range(options['repeat']):
+            df = None  # so peak RSS reflects one loaded copy, not two
+            raw = timed(read, pd.read_csv, path)
+            df = timed(prepare, prepare_data, raw)
+            del raw
+        benchmarks['read_csv'] = summarise(read, rows * len(read), 'rows/s')
+        benchmarks['preprocess_data'] = summarise(prepare, rows * len(prepare), 'rows/s')
+        benchmarks['load_and_preprocess_data'] = summarise(np.add(read, prepare), rows * len(read), 'rows/s')
+
+        # ...and with one, as on every later start
+        store_path = os.path.join(tmpdir, 'property_data.feather')
+        try:
+            written = []
+            timed(written, data_store.write, df, store_path)
+            loaded = []
+            for _ in range(options['repeat']):
+                timed(loaded, data_store.load, store_path)
+            benchmarks['data_store_write'] = summarise(written, rows, 'rows/s')
+            benchmarks['data_store_load'] = summarise(loaded, rows * len(loaded), 'rows/s')
+        except ImportError as e:
+            report['skipped']['data_store'] = str(e)
+
+        # Set up as app.py does; the pool forks before the encoder starts any threads
+        if options['pool']:
+            pool = AnalysisPool(df)
+        gemini_handler = GeminiHandler('benchmark', locations=known_locations(df))
+        gemini_handler.analysis_pool = pool
+        encoder, report['encoder'] = make_encoder(options['encoder'], options['dim'])
+        if options['cube']:
+            built = []
+            gemini_handler.aggregate_cube = timed(built, AggregateCube, df)
+            benchmarks['aggregate_cube_build'] = summarise(built, rows, 'rows/s')
+        gemini_handler.prompt_builder = AnalysisPromptBuilder(df, llm_handler=encoder)
+
+        # The embedding cache calls encode_properties for every row of a new dataset
+        encoded = []
+        encode_properties = encoder.encode_properties
+        encoder.encode_properties = lambda *args, **kwargs: timed(encoded, encode_properties, *args, **kwargs)
+        built = []
+        engine = timed(built, SearchEngine, df, encoder, embedding_cache=EmbeddingCache(os.path.join(tmpdir, 'embeddings')),
+                       index_kind=options['index'])
+        if engine.index is None:
+            raise RuntimeError("The search index could not be built")
+        benchmarks['encode_properties'] = summarise(encoded, rows * len(encoded), 'rows/s')
+        benchmarks['search_engine_build'] = summarise(built, rows, 'rows/s')
+
+        queries = search_queries(options['searches'], options['seed'])
+        engine.search(queries[0], gemini_handler.interpret_query(queries[0]).get('parameters', {}))  # warm-up
+        interpreted, searched = [], []
+        for query in queries:
+            interpretation = timed(interpreted, gemini_handler.interpret_query, query)
+            timed(searched, engine.search, query, interpretation.get('parameters', {}))
+        benchmarks['interpret_query'] = summarise(interpreted, unit='queries/s')
+        benchmarks['search'] = summarise(searched, unit='queries/s')
+
+        analysed, sources, errors = [], {}, 0
+        for i in range(options['analyses']):
+            query = ANALYSIS_QUERIES[i % len(ANALYSIS_QUERIES)]
+            parameters = gemini_handler.interpret_query(query).get('parameters', {})
+            try:
+                result = timed(analysed, gemini_handler.generate_and_execute_analysis, query, parameters, df)
+            except ValueError as e:
+                errors += 1
+                logging.warning(f"Analysis {query!r} failed: {str(e)}")
+                continue
+            source = result.get('source') or ('render_cache' if result.get('render_cached') else 'codegen')
+            sources[source] = sources.get(source, 0) + 1
+        if analysed:
+            benchmarks['generate_and_execute_analysis'] = dict(summarise(analysed, unit='analyses/s'),
+                                                              sources=sources, errors=errors)
+
+        summary = metrics.summary(collect=False)
+        report['stages'] = summary['stages']
+        report['counters'] = summary['counters']
+        report['peak_rss_mb'] = peak_rss_mb()
+        return report
+    finally:
+        if pool is not None:
+            pool.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def environment():
+    env = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+           'numpy': np.__version__, 'pandas': pd.__version__}
+    try:
+        env['commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True)
+        env['dirty'] = bool(status.stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        env['commit'] = None
+    return env
+
+
+def compare(baseline, report, threshold=REGRESSION_THRESHOLD):
+    # Lines comparing each benchmark's p50 and throughput with the baseline, and whether any regressed
+    lines, regressed = [], False
+    before = {str(r['rows']): r for r in baseline['results']}
+    for result in report['results']:
+        base = before.get(str(result['rows']))
+        if base is None:
+            continue
+        for name, now in result['benchmarks'].items():
+            then = base['benchmarks'].get(name)
+            if then is None:
+                continue
+            p50 = now['p50_ms'] / then['p50_ms'] - 1 if then['p50_ms'] else 0.0
+            throughput = now['throughput'] / then['throughput'] - 1 if now['throughput'] and then['throughput'] else 0.0
+            flag = p50 > threshold or throughput < -threshold
+            regressed |= flag
+            lines.append(f"{result['rows']:>10} {name:32} p50 {then['p50_ms']:10.2f} -> {now['p50_ms']:10.2f}ms ({p50:+.0%}), "
+                         f"{now['unit']} {then['throughput']} -> {now['throughput']} ({throughput:+.0%})"
+                         f"{'  REGRESSION' if flag else ''}")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading, encoding, search and analysis on synthetic "
+                                                 "property data, with Gemini replaced by a local fake.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma-separated row counts, e.g. 10k,100k,1m,10m")
+    parser.add_argument('--schema', choices=synthetic.SCHEMAS, default='core')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each load benchmark")
+    parser.add_argument('--searches', type=int, default=200)
+    parser.add_argument('--analyses', type=int, default=2 * len(ANALYSIS_QUERIES))
+    parser.add_argument('--gemini-latency-ms', type=float, default=500.0, help="Delay of every fake Gemini call")
+    parser.add_argument('--encoder', choices=['auto', 'model', 'hashing'], default='auto')
+    parser.add_argument('--dim', type=int, default=384, help="Embedding size of the hashing encoder")
+    parser.add_argument('--index', default='exact', help="SearchEngine index_kind")
+    parser.add_argument('--no-pool', dest='pool', action='store_false', help="Run analysis code in-process")
+    parser.add_argument('--no-cube', dest='cube', action='store_false', help="Send every analysis to code generation")
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help="Generated datasets are kept here between runs")
+    parser.add_argument('--in-process', action='store_true', help="Run every size in this process (peak RSS accumulates)")
+    parser.add_argument('--output', help="Write the JSON report here instead of printing it")
+    parser.add_argument('--results', help="Use this saved report instead of running the benchmarks")
+    parser.add_argument('--compare', help="Baseline report; exits with status 1 if anything regressed")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.results:
+        with open(args.results, encoding='utf-8') as f:
+            report = json.load(f)
+    else:
+        options = {k: v for k, v in vars(args).items() if k not in ('output', 'results', 'compare', 'threshold', 'in_process')}
+        os.makedirs(args.workdir, exist_ok=True)
+        report = {'version': REPORT_VERSION, 'environment': environment(), 'options': options, 'results': []}
+        for size in args.sizes.split(','):
+            rows = synthetic.parse_size(size.strip())
+            logging.info(f"Benchmarking {rows} rows")
+            if args.in_process:
+                report['results'].append(run_size(rows, options))
+            else:
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    report['results'].append(executor.submit(run_size, rows, options).result())
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        for result in report['results']:
+            for name, bench in result['benchmarks'].items():
+                print(f"{result['rows']:>10} {name:32} p50 {bench['p50_ms']:10.2f}ms  p99 {bench['p99_ms']:10.2f}ms  "
+                      f"{bench['throughput']} {bench['unit']}  peak RSS {bench['peak_rss_mb']}MB")
+    elif not args.compare or not args.results:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressed = compare(baseline, report, args.threshold)
+        print('\n'.join(lines))
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.prompts import LEGACY_COLUMNS, synthetic_frame
+
+# Rows generated and written per chunk, so 10M-row files never sit in memory at once
+CHUNK_ROWS = 250000
+SIZES = {'10k': 10000, '100k': 100000, '1m': 1000000, '10m': 10000000}
+
+# (town, region, postcode area, lat, long, price factor, districts)
+PLACES = [
+    ('London', 'London', 'SW', 51.507, -0.128, 2.2,
+     ['Camden', 'Westminster', 'Hackney', 'Islington', 'Lambeth', 'Southwark', 'Wandsworth', 'Croydon']),
+    ('Birmingham', 'West Midlands', 'B', 52.486, -1.890, 0.9, ['Edgbaston', 'Erdington', 'Selly Oak', 'Sutton Coldfield']),
+    ('Manchester', 'North West', 'M', 53.480, -2.242, 0.95, ['Didsbury', 'Salford', 'Stockport', 'Trafford']),
+    ('Liverpool', 'North West', 'L', 53.408, -2.991, 0.75, ['Anfield', 'Everton', 'Wavertree', 'Toxteth']),
+    ('Leeds', 'Yorkshire and The Humber', 'LS', 53.800, -1.549, 0.85, ['Headingley', 'Roundhay', 'Chapel Allerton']),
+    ('Bristol', 'South West', 'BS', 51.455, -2.588, 1.3, ['Clifton', 'Bedminster', 'Redland']),
+    ('Newcastle upon Tyne', 'North East', 'NE', 54.978, -1.618, 0.7, ['Jesmond', 'Gosforth', 'Heaton']),
+    ('Cambridge', 'East of England', 'CB', 52.205, 0.119, 1.6, ['Chesterton', 'Trumpington']),
+]
+PLACE_WEIGHTS = [0.3, 0.12, 0.12, 0.1, 0.1, 0.1, 0.08, 0.08]
+STREETS = ['High Street', 'Station Road', 'Church Lane', 'Victoria Road', 'Park Avenue', 'Mill Lane',
+           'Queens Road', 'Kings Road', 'Green Lane', 'Manor Way', 'The Crescent', 'London Road']
+# (EPC property type, share, usual tenure, bedroom range)
+PROPERTY_TYPES = [('Flat', 0.35, 'Leasehold', (1, 3)), ('House', 0.5, 'Freehold', (2, 5)),
+                  ('Bungalow', 0.08, 'Freehold', (1, 3)), ('Maisonette', 0.07, 'Leasehold', (1, 3))]
+AGE_BANDS = ['before 1900', '1900-1929', '1930-1949', '1950-1966', '1967-1975', '1976-1982', '1983-1990',
+             '1991-1995', '1996-2002', '2003-2006', '2007 onwards']
+LEASE_TERMS = ['99 years', '125 years', '250 years', '999 years']
+
+# 'core' has the columns the handlers, filters, aggregate cube and prompt builder read
+SCHEMAS = ('core', 'full')
+
+
+def _iso_dates(rng, rows, start='1995-01-01', years=30, missing=0.0):
+    # Timestamps in the export's format, e.g. 2019-06-03T11:20:45.123Z
+    offsets = rng.integers(0, years * 365 * 24 * 3600 * 1000, rows).astype('timedelta64[ms]')
+    dates = pd.Series(np.datetime_as_string(np.datetime64(f'{start}T00:00:00.000') + offsets, unit='ms'), dtype=object) + 'Z'
+    if missing:
+        dates[rng.random(rows) < missing] = None
+    return dates
+
+
+def property_frame(rows, seed=0, start_id=0, schema='core'):
+    # Deterministic properties shaped like the flattened export: places with
+    # real districts and coordinates, prices that depend on place, size and
+    # type, ISO date strings and the usual share of missing values. 'full'
+    # adds every other export column with filler values.
+    if schema not in SCHEMAS:
+        raise ValueError(f"Unknown schema {schema!r}, expected one of {SCHEMAS}")
+    rng = np.random.default_rng(seed)
+    districts = [(p, name) for p, place in enumerate(PLACES) for name in place[6]]
+    weights = np.array([PLACE_WEIGHTS[p] / len(PLACES[p][6]) for p, _ in districts])
+    district = rng.choice(len(districts), rows, p=weights / weights.sum())
+    place = np.array([p for p, _ in districts])[district]
+    district_number = np.array([i + 1 for p, place_row in enumerate(PLACES) for i in range(len(place_row[6]))])[district]
+
+    def per_place(field):
+        return np.array([row[field] for row in PLACES], dtype=object)[place]
+
+    types = rng.choice(len(PROPERTY_TYPES), rows, p=[t[1] for t in PROPERTY_TYPES])
+    low = np.array([t[3][0] for t in PROPERTY_TYPES])[types]
+    high = np.array([t[3][1] for t in PROPERTY_TYPES])[types]
+    bedrooms = rng.integers(low, high + 1).astype(np.float64)
+    area = np.round(250 + 260 * bedrooms + rng.normal(0, 80, rows)).clip(250)
+    ppsqft = 320 * per_place(5).astype(np.float64) * rng.lognormal(0, 0.25, rows)
+    price = np.round(area * ppsqft, -3)
+    price[rng.random(rows) < 0.08] = np.nan
+    usual_tenure = np.array([t[2] for t in PROPERTY_TYPES], dtype=object)[types]
+    tenure = np.where(rng.random(rows) < 0.9, usual_tenure,
+                      np.where(usual_tenure == 'Freehold', 'Leasehold', 'Freehold')).astype(object)
+
+    area_code = per_place(2)
+    inward = pd.Series(rng.integers(1, 10, rows).astype(str), dtype=object) + \
+        pd.Series(np.array(list('ABDEFGHJLNPQRSTUWXYZ'), dtype=object)[rng.integers(0, 20, (rows, 2))].sum(axis=1), dtype=object)
+    outward = pd.Series(area_code, dtype=object) + pd.Series(district_number.astype(str), dtype=object)
+    sector = outward + ' ' + inward.str[0]
+    building_number = rng.integers(1, 300, rows)
+    street = pd.Series(np.array(STREETS, dtype=object)[rng.integers(0, len(STREETS), rows)], dtype=object)
+    town = pd.Series(per_place(0), dtype=object)
+    ids = np.arange(start_id, start_id + rows)
+    sale_dates = _iso_dates(rng, rows, missing=0.05)
+
+    data = {
+        '_id.oid': pd.Series(ids).map('{:024x}'.format),
+        'uprn.numberLong': 100000000000 + ids,
+        'address': pd.Series(building_number.astype(str), dtype=object) + ' ' + street + ', ' + town,
+        'postcode': outward + ' ' + inward,
+        'street': street,
+        'building_number': building_number,
+        'sector': sector,
+        'sector_name': sector,
+        'district': np.array([name for _, name in districts], dtype=object)[district],
+        'district_name': outward,
+        'town': town,
+        'region': per_place(1),
+        'postcode_area': area_code,
+        'lat': per_place(3).astype(np.float64) + rng.normal(0, 0.04, rows),
+        'long': per_place(4).astype(np.float64) + rng.normal(0, 0.06, rows),
+        'latest_sale_price': price,
+        'latest_price_ppsqft': np.round(price / area, 2),
+        'latest_sale_date': sale_dates,
+        'latest_tenure': tenure,
+        'latest_new_build': np.where(rng.random(rows) < 0.1, 'Y', 'N').astype(object),
+        'lease_term': np.where(tenure == 'Leasehold',
+                               np.array(LEASE_TERMS, dtype=object)[rng.integers(0, len(LEASE_TERMS), rows)], None),
+        'secondary_property_type.epc': np.array([t[0] for t in PROPERTY_TYPES], dtype=object)[types],
+        'secondary_bedrooms.listings.numberDouble': bedrooms,
+        'secondary_bathrooms.listings.numberDouble': np.maximum(1, bedrooms - rng.integers(0, 2, rows)),
+        'secondary_area.epc': area,
+        'habitable_rooms': bedrooms + 1,
+        'age_band': np.array(AGE_BANDS, dtype=object)[rng.integers(0, len(AGE_BANDS), rows)],
+        'floor_level': np.where(types == 0, rng.integers(0, 12, rows).astype(str), '').astype(object),
+        'epc_values.current_energy_efficiency': rng.integers(20, 96, rows).astype(np.float64),
+        'secondary_latest_sale_date.lr.date': sale_dates,
+        'date_created.date': _iso_dates(rng, rows, start='2020-01-01', years=3),
+        'date_updated.date': _iso_dates(rng, rows, start='2023-01-01', years=1),
+    }
+    df = pd.DataFrame(data)
+    if schema == 'full':
+        others = [c for c in LEGACY_COLUMNS.split('\t') if c not in data]
+        df = pd.concat([df, synthetic_frame(rows, seed, columns=others)], axis=1)
+    return df
+
+
+def write_csv(path, rows, seed=0, schema='core', chunk_rows=CHUNK_ROWS):
+    # Generated and appended chunk by chunk; the same arguments always give the same file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    for start in range(0, rows, chunk_rows):
+        chunk = property_frame(min(chunk_rows, rows - start), seed=[seed, start // chunk_rows], start_id=start, schema=schema)
+        chunk.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def dataset_path(directory, rows, seed=0, schema='core'):
+    return os.path.join(directory, f"property_data_{rows}_{schema}_{seed}.csv")
+
+
+def parse_size(size):
+    # '100k', '1m' or a plain row count
+    return SIZES[size.lower()] if size.lower() in SIZES else int(size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic property CSV shaped like data/property_data.csv.")
+    parser.add_argument('--rows', default='100k', help="Row count, or one of " + ', '.join(SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--schema', choices=SCHEMAS, default='core',
+                        help="'core' for the columns the app reads, 'full' for every export column")
+    parser.add_argument('--output', help="Defaults to cache/benchmarks/property_data_<rows>_<schema>_<seed>.csv")
+    args = parser.parse_args(argv)
+
+    rows = parse_size(args.rows)
+    path = args.output or dataset_path(os.path.join('cache', 'benchmarks'), rows, args.seed, args.schema)
+    start = time.perf_counter()
+    write_csv(path, rows, args.seed, args.schema)
+    print(f"Wrote {rows} rows to {path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,464 @@
+import hashlib
+import io
+import itertools
+import logging
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from src.cache import SizedCache
+from src.data_loader import parse_dates
+from src.filters import PARAMETER_ALIASES, PROPERTY_TYPE_COLUMNS, PROPERTY_TYPE_SYNONYMS, TENURE_COLUMNS
+from src.metrics import metrics
+from src.query_parser import (ANALYSIS_WORDS, FILLER_WORDS, PROPERTY_TYPE_WORDS, SEARCH_WORDS, TENURE_WORDS,
+                              normalise_query)
+
+SALE_DATE_COLUMN = 'latest_sale_date'
+MEASURE_COLUMNS = {'price': 'latest_sale_price', 'ppsqft': 'latest_price_ppsqft'}
+TIME_LEVELS = {None: [], 'year': ['year'], 'quarter': ['year', 'quarter']}
+GEO_DIMENSIONS = ['district', 'town', 'region']
+CATEGORY_DIMENSIONS = GEO_DIMENSIONS + ['tenure', 'property_type']
+DIMENSIONS = TIME_LEVELS['quarter'] + CATEGORY_DIMENSIONS
+UNKNOWN = 'Unknown'
+# A refresh touching more than this share of rows rebuilds the cube instead
+FULL_REBUILD_RATIO = 0.3
+# Groups drawn per chart; the table keeps all of them
+MAX_PLOTTED_GROUPS = 10
+
+# Interpreted parameters that describe the analysis rather than filter the data
+DESCRIPTIVE_PARAMETERS = {
+    'analysis_type', 'analysis', 'metric', 'metrics', 'measure', 'statistic', 'aggregation', 'time_period',
+    'period', 'time_frame', 'timeframe', 'group_by', 'groupby', 'chart_type', 'chart', 'plot_type',
+    'visualization', 'visualisation', 'interval', 'frequency', 'granularity',
+}
+YEAR_PARAMETERS = {'year': 'year', 'start_year': 'start', 'from_year': 'start', 'end_year': 'end', 'to_year': 'end'}
+
+_PPSQFT = re.compile(r'\b(?:price\s+)?per\s+(?:sq|square)\s*(?:ft|feet|foot)\b|\bppsqft\b|\bpsf\b')
+_MEDIAN = re.compile(r'\bmedian\b')
+_MEAN = re.compile(r'\b(?:average|avg|mean)\b')
+_SUM = re.compile(r'\b(?:total|sum)\b')
+_COUNT = re.compile(r'\b(?:counts?|number of|how many|volumes?)\b')
+_PRICE = re.compile(r'\b(?:prices?|sale_price|values?)\b')
+_QUARTER = re.compile(r'\b(?:quarters?|quarterly)\b')
+_YEARLY = re.compile(r'\b(?:years?|yearly|annual|annually|over time|trends?|changes?|changed|growth)\b')
+_SHARE = re.compile(r'\b(?:mix|share|shares|split|proportions?|percentage|breakdown|distribution)\b')
+_GROUPS = [
+    ('property_type', re.compile(r'\b(?:property\s+)?types?\b')),
+    ('tenure', re.compile(r'\btenures?\b')),
+    ('district', re.compile(r'\bdistricts?\b')),
+    ('town', re.compile(r'\b(?:towns?|cities|city)\b')),
+    ('region', re.compile(r'\bregions?\b')),
+]
+CUBE_WORDS = {
+    'sq', 'square', 'ft', 'feet', 'foot', 'ppsqft', 'psf', 'quarters', 'annual', 'annually', 'shares',
+    'split', 'proportion', 'proportions', 'percentage', 'value', 'values', 'volume', 'volumes', 'sum',
+    'tenures', 'cities', 'city',
+}
+# Fillers the interpreter may pass over but that qualify the data in ways the
+# cube has no dimension for ("last 5 years", "new houses", "3 bedrooms")
+NON_CUBE_WORDS = {
+    'last', 'new', 'cheap', 'affordable', 'near', 'nearby', 'close', 'room', 'rooms', 'bed', 'beds',
+    'bedroom', 'bedrooms',
+}
+CUBE_FILLER_WORDS = FILLER_WORDS - NON_CUBE_WORDS
+
+
+def _categories(df, columns):
+    # First non-empty value across columns, as a category with UNKNOWN for gaps
+    result = pd.Series(np.nan, index=df.index, dtype=object)
+    for col in columns:
+        if col in df.columns:
+            values = df[col].astype(object)
+            result = result.fillna(values.where(values.notna() & (values.astype(str).str.strip() != '')))
+    return result.fillna(UNKNOWN).astype(str).str.strip().astype('category')
+
+
+def _measure(df, column):
+    # preprocess_data fills missing numbers with 0, and a zero price is not a sale
+    if column not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    values = pd.to_numeric(df[column], errors='coerce').astype(np.float64)
+    return values.where(values > 0)
+
+
+def fact_table(df):
+    # One row per property with the cube's dimensions and measures
+    if SALE_DATE_COLUMN in df.columns:
+        dates = parse_dates(df[SALE_DATE_COLUMN])
+    else:
+        dates = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns, UTC]')
+    facts = pd.DataFrame({
+        # Unsold properties land in year 0, which is left out of time series
+        'year': dates.dt.year.fillna(0).astype(np.int16),
+        'quarter': dates.dt.quarter.fillna(0).astype(np.int8),
+    }, index=df.index)
+    for dim in GEO_DIMENSIONS:
+        facts[dim] = _categories(df, [dim])
+    facts['tenure'] = _categories(df, TENURE_COLUMNS)
+    facts['property_type'] = _categories(df, PROPERTY_TYPE_COLUMNS)
+    for measure, column in MEASURE_COLUMNS.items():
+        facts[measure] = _measure(df, column)
+    return facts.reset_index(drop=True)
+
+
+def cuboid_dimensions():
+    # Every combination of time level, geography, tenure and property type
+    for time_level, geo, tenure, property_type in itertools.product(TIME_LEVELS, [None] + GEO_DIMENSIONS, [False, True], [False, True]):
+        yield tuple(TIME_LEVELS[time_level] + ([geo] if geo else []) + (['tenure'] if tenure else [])
+                    + (['property_type'] if property_type else []))
+
+
+def aggregate(facts, dims, medians=True):
+    # Statistics per group, one flat column per measure and statistic, keyed
+    # by plain values so tables from different fact tables line up
+    keys = list(dims) if dims else np.zeros(len(facts), dtype=np.int8)
+    grouped = facts.groupby(keys, observed=True, sort=True)[list(MEASURE_COLUMNS)]
+    # One grouping pass shared by every statistic; the mean follows from sum and count
+    count, total = grouped.count(), grouped.sum()
+    table = pd.DataFrame({'rows': grouped.size()}, index=count.index)
+    for measure in MEASURE_COLUMNS:
+        table[f'{measure}_count'] = count[measure]
+        table[f'{measure}_sum'] = total[measure]
+    if medians:
+        median = grouped.median()
+        for measure in MEASURE_COLUMNS:
+            table[f'{measure}_mean'] = table[f'{measure}_sum'] / table[f'{measure}_count'].replace(0, np.nan)
+            table[f'{measure}_median'] = median[measure]
+    if isinstance(table.index, pd.MultiIndex):
+        table.index = pd.MultiIndex.from_arrays(
+            [table.index.get_level_values(d).astype(object) if d in CATEGORY_DIMENSIONS else table.index.get_level_values(d) for d in dims])
+    elif dims and dims[0] in CATEGORY_DIMENSIONS:
+        table.index = table.index.astype(object)
+    return table
+
+
+def signed_changes(added, removed):
+    # Added rows counted +1 and removed rows -1, with plain-valued dimensions,
+    # so grouped sums are the change in every additive statistic
+    changes = pd.concat([added, removed], ignore_index=True)
+    sign = np.concatenate([np.ones(len(added)), -np.ones(len(removed))])
+    signed = pd.DataFrame({d: changes[d].astype(object) if d in CATEGORY_DIMENSIONS else changes[d] for d in DIMENSIONS})
+    signed['rows'] = sign
+    for measure in MEASURE_COLUMNS:
+        signed[f'{measure}_count'] = sign * changes[measure].notna().to_numpy()
+        signed[f'{measure}_sum'] = sign * changes[measure].fillna(0).to_numpy()
+    return signed
+
+
+def _group_hashes(frame, dims):
+    # One hash per row of the dimension values, comparable between fact
+    # tables and cuboid indexes since categories are hashed as plain values
+    columns = {d: frame[d].astype(object) if d in CATEGORY_DIMENSIONS else frame[d].astype(np.int64) for d in dims}
+    return pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+
+
+class AggregateCube:
+    # Count, sum, mean and median of sale price and price per sq ft,
+    # materialised for every combination of year/quarter, district/town/region,
+    # tenure and property type. answer() returns None for any analysis it
+    # cannot cover so the caller falls back to generated code, and refresh()
+    # only recomputes the groups holding added, removed or changed rows.
+
+    def __init__(self, df=None):
+        self.facts = None
+        self.cuboids = {}
+        self.values = {}
+        # Groups per cuboid whose medians are out of date after a refresh
+        self._stale = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Charts keyed on a hash of the table they plot, so repeats skip matplotlib
+        self.render_cache = SizedCache(16 * 1024 * 1024)
+        if df is not None:
+            self.build(df)
+
+    def build(self, df):
+        start = time.perf_counter()
+        facts = fact_table(df)
+        cuboids = {dims: aggregate(facts, dims) for dims in cuboid_dimensions()}
+        with self._lock:
+            self.facts, self.cuboids, self._stale = facts, cuboids, {}
+            self._hashes = pd.util.hash_pandas_object(facts, index=False).to_numpy()
+            self._vocabulary()
+        logging.info(f"Built aggregate cube ({len(self.cuboids)} cuboids over {len(self.facts)} rows) "
+                     f"in {time.perf_counter() - start:.2f}s")
+
+    def _vocabulary(self):
+        # Lower-cased dimension values, to match filters
+        self.values = {dim: {str(v).lower(): v for v in self.facts[dim].unique()} for dim in CATEGORY_DIMENSIONS}
+
+    def refresh(self, df):
+        if self.facts is None:
+            return self.build(df)
+        start = time.perf_counter()
+        facts = fact_table(df)
+        hashes = pd.util.hash_pandas_object(facts, index=False).to_numpy()
+        # Row contents that occur a different number of times than before
+        counts = pd.concat([pd.Series(self._hashes).value_counts(), pd.Series(hashes).value_counts()], axis=1).fillna(0)
+        changed = counts.index[counts.iloc[:, 0] != counts.iloc[:, 1]].to_numpy()
+        removed = self.facts[np.isin(self._hashes, changed)]
+        added = facts[np.isin(hashes, changed)]
+        if len(removed) + len(added) > FULL_REBUILD_RATIO * max(len(facts), 1):
+            return self.build(df)
+
+        signed = signed_changes(added, removed)
+        additive = [c for c in signed.columns if c not in DIMENSIONS]
+        with self._lock:
+            for dims, table in (self.cuboids.items() if len(changed) else []):
+                # Counts and sums move by the difference; means follow from them
+                keys = list(dims) if dims else np.zeros(len(signed), dtype=np.int8)
+                delta = signed.groupby(keys, sort=False)[additive].sum()
+                merged = table[additive].add(delta, fill_value=0)
+                merged = merged[merged['rows'] > 0]
+                # The signed deltas are floats; counts go back to integers so
+                # answers print "14" rather than "14.00"
+                counts = ['rows'] + [f'{measure}_count' for measure in MEASURE_COLUMNS]
+                merged[counts] = merged[counts].round().astype(np.int64)
+                for measure in MEASURE_COLUMNS:
+                    count = merged[f'{measure}_count']
+                    merged[f'{measure}_sum'] = merged[f'{measure}_sum'].where(count > 0, 0.0)
+                    merged[f'{measure}_mean'] = merged[f'{measure}_sum'] / count.replace(0, np.nan)
+                    # Medians of touched groups are recomputed when next read
+                    merged[f'{measure}_median'] = table[f'{measure}_median'].reindex(merged.index)
+                self.cuboids[dims] = merged.sort_index()
+                self._stale[dims] = self._stale.get(dims, delta.index[:0]).union(delta.index)
+            self.facts, self._hashes = facts, hashes
+            self._vocabulary()
+        logging.info(f"Refreshed aggregate cube for {len(removed)} removed and {len(added)} added rows "
+                     f"in {time.perf_counter() - start:.2f}s")
+
+    def cuboid(self, dims):
+        # A cuboid with its medians brought up to date
+        with self._lock:
+            stale = self._stale.pop(dims, None)
+            table = self.cuboids[dims]
+            if stale is not None and len(stale):
+                rows = self.facts
+                if dims:
+                    groups = stale.to_frame(index=False)
+                    groups.columns = list(dims)
+                    keys = _group_hashes(groups, dims)
+                    rows = rows[np.isin(_group_hashes(rows, dims), keys)]
+                fresh = aggregate(rows, dims)
+                for measure in MEASURE_COLUMNS:
+                    table.loc[fresh.index, f'{measure}_median'] = fresh[f'{measure}_median']
+            return table
+
+    def _filters(self, parameters):
+        # (filters, years) from the interpreted parameters, or None if one cannot be applied
+        filters, years = {}, {}
+        for key, value in (parameters or {}).items():
+            if value is None or value == '' or value == []:
+                continue
+            name = str(key).strip().lower().replace(' ', '_')
+            if name in DESCRIPTIVE_PARAMETERS:
+                continue
+            if name in YEAR_PARAMETERS:
+                try:
+                    years[YEAR_PARAMETERS[name]] = int(value)
+                except (TypeError, ValueError):
+                    return None
+                continue
+            field = PARAMETER_ALIASES.get(name, name)
+            if field not in ('location', 'property_type', 'tenure') or isinstance(value, (list, dict)):
+                return None
+            text = str(value).strip().lower()
+            if field == 'property_type':
+                text = PROPERTY_TYPE_SYNONYMS.get(text, text)
+            dims = GEO_DIMENSIONS if field == 'location' else [field]
+            dim = next((d for d in dims if text in self.values[d]), None)
+            if dim is None:
+                return None
+            filters[dim] = self.values[dim][text]
+        return filters, years
+
+    def _filter_words(self, filters):
+        # Query words explained by the filters being applied: the words of each
+        # filtered value, plus the type and tenure words that map onto it
+        words = {w for value in filters.values() for w in re.findall(r'\w+', str(value).lower())}
+        for dim, vocabulary in (('property_type', PROPERTY_TYPE_WORDS), ('tenure', TENURE_WORDS)):
+            if dim in filters:
+                for word, name in vocabulary.items():
+                    name = PROPERTY_TYPE_SYNONYMS.get(name, name) if dim == 'property_type' else name
+                    if self.values[dim].get(name) == filters[dim]:
+                        words.add(word)
+        return words
+
+    def _cuboid(self, dims):
+        # Stored cuboid holding exactly these dimensions, or None
+        return next((d for d in self.cuboids if set(d) == set(dims)), None)
+
+    def parse(self, query, parameters=None):
+        # Analysis spec for a query the cube can answer, otherwise None
+        if self.facts is None:
+            return None
+        resolved = self._filters(parameters)
+        if resolved is None:
+            return None
+        filters, years = resolved
+        text = normalise_query(query)
+
+        measure = 'ppsqft' if _PPSQFT.search(text) else 'price'
+        text = _PPSQFT.sub(' ', text)
+        if _MEDIAN.search(text):
+            stat = 'median'
+        elif _MEAN.search(text):
+            stat = 'mean'
+        # "total number of sales" is a count, so counts are matched before sums
+        elif _COUNT.search(text):
+            stat = 'count'
+        elif _SUM.search(text):
+            stat = 'sum'
+        elif not (_PRICE.search(text) or measure == 'ppsqft'):
+            stat = 'count'
+        else:
+            stat = 'mean'
+        time_level = 'quarter' if _QUARTER.search(text) else 'year' if _YEARLY.search(text) else None
+        groups = [dim for dim, pattern in _GROUPS if pattern.search(text) and dim not in filters]
+        if len(groups) > 1:
+            return None
+        group = groups[0] if groups else None
+        share = bool(group) and bool(_SHARE.search(text))
+
+        # Every word has to be accounted for, as in LocalQueryInterpreter. Places,
+        # types and tenures only count when a filter applies them, and the only
+        # numbers allowed are the years already taken as filters.
+        known = CUBE_FILLER_WORDS | ANALYSIS_WORDS | SEARCH_WORDS | CUBE_WORDS | self._filter_words(filters)
+        for word in re.findall(r'\w+', text):
+            if word.isdigit():
+                if int(word) not in years.values():
+                    return None
+            elif word not in known:
+                return None
+
+        dims = TIME_LEVELS[time_level] + ([group] if group else []) + list(filters)
+        if years and 'year' not in dims:
+            dims.append('year')
+        cuboid = self._cuboid(dims)
+        if cuboid is None:
+            return None
+        if share:
+            stat = 'count'
+        # Medians cannot be rolled up across the years of a finer cuboid
+        if stat == 'median' and 'year' in cuboid and time_level is None and years.keys() != {'year'}:
+            return None
+        return {'cuboid': cuboid, 'measure': measure, 'stat': stat, 'time': time_level, 'group': group,
+                'share': share, 'filters': filters, 'years': years}
+
+    def table(self, spec):
+        frame = self.cuboid(spec['cuboid']).reset_index()
+        mask = np.ones(len(frame), dtype=bool)
+        for dim, value in spec['filters'].items():
+            mask &= (frame[dim].astype(str) == str(value)).to_numpy()
+        if 'year' in frame.columns:
+            mask &= (frame['year'] > 0).to_numpy()
+            bounds = spec['years']
+            if 'year' in bounds:
+                mask &= (frame['year'] == bounds['year']).to_numpy()
+            if 'start' in bounds:
+                mask &= (frame['year'] >= bounds['start']).to_numpy()
+            if 'end' in bounds:
+                mask &= (frame['year'] <= bounds['end']).to_numpy()
+        frame = frame[mask]
+        if spec['time'] == 'quarter':
+            frame = frame.assign(period=frame['year'].astype(str) + ' Q' + frame['quarter'].astype(str))
+        elif spec['time'] == 'year':
+            frame = frame.assign(period=frame['year'])
+
+        # Roll what is left up to the requested dimensions; count and sum add
+        # up and the mean is sum/count, while a median is only ever one row
+        measure = spec['measure']
+        columns = [f'{measure}_count', f'{measure}_sum', f'{measure}_median']
+        keys = (['period'] if spec['time'] else []) + ([spec['group']] if spec['group'] else [])
+        totals = frame.groupby(keys, observed=True)[columns].sum() if keys else frame[columns].sum().to_frame('total').T
+        if spec['stat'] == 'mean':
+            values = totals[f'{measure}_sum'] / totals[f'{measure}_count'].replace(0, np.nan)
+        else:
+            values = totals[f"{measure}_{spec['stat']}"]
+        values = values[totals[f'{measure}_count'] > 0].rename(spec['stat'])
+
+        if spec['time'] and spec['group']:
+            result = values.unstack(spec['group'])
+            if spec['share']:
+                result = result.div(result.sum(axis=1), axis=0) * 100
+        elif spec['group']:
+            result = values.sort_values(ascending=False)
+            if spec['share']:
+                result = result / result.sum() * 100
+        else:
+            result = values
+        return result
+
+    def describe(self, spec):
+        measure = 'price per sq ft' if spec['measure'] == 'ppsqft' else 'sale price'
+        if spec['share']:
+            title = 'Share of sales (%)'
+        elif spec['stat'] == 'count':
+            title = 'Number of sales'
+        else:
+            title = f"{spec['stat'].capitalize()} {measure}"
+        if spec['group']:
+            title += f" by {spec['group'].replace('_', ' ')}"
+        if spec['time']:
+            title += f" per {spec['time']}"
+        for dim, value in spec['filters'].items():
+            title += f", {dim.replace('_', ' ')} {value}"
+        for bound, year in spec['years'].items():
+            title += f", {'from' if bound == 'start' else 'to' if bound == 'end' else 'in'} {year}"
+        return title
+
+    def plot(self, result, spec, title):
+        # PNG bytes of a line chart over time or a bar chart of groups. A bare
+        # Figure rather than pyplot, so concurrent answers share no state.
+        if not spec['time'] and not spec['group']:
+            return []
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        if isinstance(result, pd.DataFrame):
+            top = result.sum().sort_values(ascending=False).index[:MAX_PLOTTED_GROUPS]
+            result[top].plot(ax=ax, marker='o')
+            ax.legend(title=spec['group'].replace('_', ' '), fontsize='small')
+        elif spec['time']:
+            result.plot(ax=ax, marker='o')
+        else:
+            result.head(MAX_PLOTTED_GROUPS * 2).plot.bar(ax=ax)
+        ax.set_title(title)
+        ax.set_ylabel('%' if spec['share'] else 'sales' if spec['stat'] == 'count' else '£')
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+        return [buffer.getvalue()]
+
+    def answer(self, query, parameters=None):
+        # Result shaped like generate_and_execute_analysis's, or None
+        spec = self.parse(query, parameters)
+        result = self.table(spec) if spec is not None else None
+        if result is None or len(result) == 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        title = self.describe(spec)
+        with pd.option_context('display.max_rows', 200, 'display.width', 200, 'display.float_format', '{:,.2f}'.format):
+            output = f"{title}\n{result.to_string()}\n"
+        key = hashlib.sha256(f"{title}\n{result.to_csv()}".encode()).hexdigest()
+        figures = self.render_cache.get(key)
+        if figures is None:
+            with metrics.span('render'):
+                figures = self.plot(result, spec, title)
+            self.render_cache.put(key, figures, sum(len(f) for f in figures))
+        return {
+            'figures': figures,
+            'figure_format': 'png',
+            'code': '',
+            'output': output,
+            'error': '',
+            'source': 'aggregate_cube',
+        }
+
+    def stats(self):
+        return {'cuboids': len(self.cuboids), 'rows': 0 if self.facts is None else len(self.facts),
+                'hits': self.hits, 'misses': self.misses, 'render_cache': self.render_cache.stats()}
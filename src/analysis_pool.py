@@ -0,0 +1,186 @@
+import logging
+import multiprocessing
+import os
+import threading
+
+from src.cache import SizedCache
+from src.code_executor import code_key, extract_and_execute_code
+
+# DataFrame the workers run analyses against. Workers started from a
+# forkserver memory-map it from the data store, so they share its pages
+# through the page cache; forked workers inherit it from the parent, which
+# sets it before the pool starts, and share its pages copy-on-write.
+_shared_df = None
+
+
+def _limit_memory(headroom_mb):
+    try:
+        import resource
+    except ImportError:
+        return  # Not available on Windows
+    # RLIMIT_AS counts address space, so the limit is the inherited size plus headroom
+    with open('/proc/self/statm') as f:
+        current = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    limit = current + headroom_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _init_worker(df, memory_limit_mb, store=None):
+    global _shared_df
+    if store is not None:
+        from src import data_store
+        _shared_df = data_store.load(*store)
+    elif df is not None:
+        _shared_df = df  # Only needed when workers are spawned rather than forked
+    # Set after the frame is mapped, which counts towards the address space
+    if memory_limit_mb:
+        try:
+            _limit_memory(memory_limit_mb)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not set analysis worker memory limit: {str(e)}")
+
+
+def _run_job(code, fmt='png'):
+    # A shallow copy keeps columns added by the generated code out of the shared frame
+    df = _shared_df.copy(deep=False) if _shared_df is not None else None
+    result = extract_and_execute_code(code, df, fmt)
+    if not result['success'] and 'MemoryError' in result['traceback']:
+        result['error'] = "Analysis exceeded the worker memory limit"
+    return result
+
+
+class _Job:
+    # One submitted analysis. done is set by the pool's callbacks with the
+    # result, or by a pool restart with no result, telling the waiting caller
+    # to submit it again.
+
+    def __init__(self, code, figure_format):
+        self.code = code
+        self.figure_format = figure_format
+        self.result = None
+        self.done = threading.Event()
+
+    def finished(self, result):
+        # Runs on the pool's result thread, so it must not take AnalysisPool._lock
+        self.result = result
+        self.done.set()
+
+    def failed(self, error):
+        self.finished({'success': False, 'error': f"Analysis worker failed: {str(error)}", 'stdout': ''})
+
+
+class AnalysisPool:
+    # Pre-warmed worker processes that already hold the preprocessed DataFrame.
+    # Generated analysis code runs there with a per-job timeout and memory
+    # limit; stdout and figures come back in the result instead of files.
+    # Successful results are kept in a render cache keyed on a hash of the
+    # code, so a repeated chart is not plotted again until the data changes.
+    #
+    # Pass store=(path, columns) when df was loaded from a data store: workers
+    # are then started from a forkserver and load the frame from the store
+    # themselves. Without it workers are forked from this process, which is
+    # only safe before other threads start. Restarts after a reload or a
+    # timeout, and workers recycled after max_jobs_per_worker jobs, fork a
+    # process where the embedding model, Streamlit or the service may already
+    # be running threads, and a worker can deadlock on a lock one of them held.
+
+    def __init__(self, df, processes=2, timeout=120, memory_limit_mb=2048, max_jobs_per_worker=50,
+                 figure_format='png', render_cache_mb=64, store=None):
+        self.processes = processes
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.figure_format = figure_format
+        self.render_cache = SizedCache(render_cache_mb * 1024 * 1024)
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        # Jobs submitted to the current pool that their callers are still waiting on
+        self._pending = set()
+        self.reload(df, store)
+
+    def _start(self):
+        global _shared_df
+        methods = multiprocessing.get_all_start_methods()
+        if self.store is not None and 'forkserver' in methods:
+            # The server is a fresh single-threaded interpreter that workers fork from;
+            # preloading this module imports pandas and matplotlib there once (and
+            # keeps it from re-running the app's __main__)
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['src.analysis_pool'])
+            initargs = (None, self.memory_limit_mb, self.store)
+        else:
+            _shared_df = self.df
+            context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+            # Forked workers inherit _shared_df; spawned ones need it pickled across
+            initargs = (None if context.get_start_method() == 'fork' else self.df, self.memory_limit_mb)
+        self._pool = context.Pool(self.processes, initializer=_init_worker, initargs=initargs,
+                                  maxtasksperchild=self.max_jobs_per_worker)
+
+    def reload(self, df, store=None):
+        with self._lock:
+            self.df = df
+            self.store = store
+            self.generation += 1
+            self.render_cache.clear()
+            self._restart()
+
+    def _submit(self, job):
+        # Called with self._lock held
+        self._pending.add(job)
+        self._pool.apply_async(_run_job, (job.code, job.figure_format), callback=job.finished, error_callback=job.failed)
+
+    def _restart(self):
+        # Called with self._lock held. Jobs still pending on the old pool would
+        # never complete, so their callers are woken to resubmit them.
+        self._terminate()
+        self._start()
+        pending, self._pending = self._pending, set()
+        for job in pending:
+            job.done.set()
+
+    def _terminate(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def run(self, code, timeout=None):
+        timeout = timeout or self.timeout
+        key = code_key(code, self.figure_format)
+        cached = self.render_cache.get(key)
+        if cached is not None:
+            return dict(cached, render_cached=True)
+        job = _Job(code, self.figure_format)
+        with self._lock:
+            generation = self.generation
+            self._submit(job)
+        # Each wait gets the full timeout, since a job resubmitted after another
+        # one's timeout or a reload lost its place through no fault of its own
+        while job.done.wait(timeout) and job.result is None:
+            with self._lock:
+                job.done.clear()
+                self._submit(job)
+
+        with self._lock:
+            self._pending.discard(job)
+            if job.result is None and not job.done.is_set():
+                # A stuck worker cannot be interrupted individually, so replace the
+                # whole pool; if it was already replaced under this job, once is enough
+                logging.error(f"Analysis job timed out after {timeout}s, restarting workers")
+                self._restart()
+        result = job.result
+        if result is None:
+            return {'success': False, 'error': f"Analysis timed out after {timeout} seconds", 'stdout': ''}
+        # Results computed against data that has since been reloaded are not kept
+        if result['success'] and generation == self.generation:
+            size = sum(len(f) for f in result['figures']) + len(result['stdout'])
+            self.render_cache.put(key, result, size)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
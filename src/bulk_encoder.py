@@ -0,0 +1,142 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Unique texts sent to a worker at a time; bounds what is held in memory per chunk
+DEFAULT_CHUNK_SIZE = 4096
+DEFAULT_BATCH_SIZE = 64
+PROGRESS_INTERVAL = 5.0
+# Text columns combined into the string that gets embedded for each property
+TEXT_COLUMNS = ['address', 'postcode', 'district', 'sector', 'town', 'region']
+
+# Model loaded once per worker process
+_model = None
+_batch_size = DEFAULT_BATCH_SIZE
+
+
+def property_texts(df, columns):
+    # Vectorised equivalent of ' '.join over each row's text columns
+    parts = [df[col].astype(object).fillna('').astype(str) for col in columns]
+    if not parts:
+        return pd.Series('', index=df.index)
+    return parts[0].str.cat(parts[1:], sep=' ')
+
+
+def _init_worker(model_name, threads, batch_size):
+    global _model, _batch_size
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Workers split the cores between them instead of each using all of them
+    torch.set_num_threads(threads)
+    _model = SentenceTransformer(model_name, device='cpu')
+    _batch_size = batch_size
+
+
+def _encode_chunk(task):
+    start, texts = task
+    embeddings = _model.encode(texts, batch_size=_batch_size, convert_to_numpy=True)
+    return start, np.asarray(embeddings, dtype=np.float32)
+
+
+class BulkEncoder:
+    # Encodes many property strings at once. Identical strings (flats in one
+    # building share an address) are encoded once; unique strings go through
+    # the model in fixed-size chunks, in-process or across a pool of CPU
+    # workers, and each chunk is scattered straight into a preallocated
+    # (optionally memory-mapped) output array.
+
+    def __init__(self, model_name, model=None, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, progress=None):
+        self.model_name = model_name
+        self.model = model
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.progress = progress  # Called as progress(encoded, total) after every chunk
+        self.last_stats = None
+
+    def _dimension(self):
+        if self.model is not None and hasattr(self.model, 'get_sentence_embedding_dimension'):
+            return self.model.get_sentence_embedding_dimension() or 0
+        return 0
+
+    def _allocate(self, rows, dim, out_path):
+        if out_path is None:
+            return np.empty((rows, dim), dtype=np.float32)
+        directory = os.path.dirname(out_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(rows, dim))
+
+    def _encode_local(self, chunks):
+        for start, texts in chunks:
+            embeddings = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+            yield start, np.asarray(embeddings, dtype=np.float32)
+
+    def _encode_parallel(self, chunks, workers):
+        # Spawned rather than forked: torch's thread pools do not survive a fork
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.model_name, threads, self.batch_size)) as executor:
+            # At most two chunks per worker are queued or waiting to be written
+            pending = []
+            for chunk in chunks:
+                pending.append(executor.submit(_encode_chunk, chunk))
+                if len(pending) >= 2 * workers:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def encode(self, texts, out_path=None):
+        start_time = time.perf_counter()
+        codes, uniques = pd.factorize(pd.Series(texts, dtype=object))
+        rows, total = len(codes), len(uniques)
+
+        # Rows grouped by the unique text they use, so each chunk maps to a contiguous slice
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(total + 1))
+        chunks = ((start, uniques[start:start + self.chunk_size].tolist()) for start in range(0, total, self.chunk_size))
+
+        workers = self.workers if self.workers > 0 else (os.cpu_count() or 1)
+        if workers == 1 or total <= self.chunk_size:
+            if self.model is None:
+                raise RuntimeError("BulkEncoder needs a model to encode in-process")
+            results = self._encode_local(chunks)
+        else:
+            results = self._encode_parallel(chunks, workers)
+
+        out = self._allocate(rows, self._dimension(), out_path) if total == 0 else None
+        encoded, last_report = 0, start_time
+        for start, embeddings in results:
+            if out is None:
+                out = self._allocate(rows, embeddings.shape[1], out_path)
+            positions = order[bounds[start]:bounds[start + len(embeddings)]]
+            out[positions] = embeddings[codes[positions] - start]
+            encoded += len(embeddings)
+
+            if self.progress is not None:
+                self.progress(encoded, total)
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                logging.info(f"Encoded {encoded}/{total} unique property texts ({encoded / (now - start_time):.0f}/s)")
+                last_report = now
+
+        if isinstance(out, np.memmap):
+            out.flush()
+        seconds = time.perf_counter() - start_time
+        self.last_stats = {
+            'rows': rows,
+            'unique': total,
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds > 0 else 0.0,
+        }
+        logging.info(f"Encoded {rows} properties ({total} unique texts) in {seconds:.1f}s, "
+                     f"{self.last_stats['rows_per_second']:.0f} rows/s")
+        return out
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from src.query_parser import normalise_query
+
+DEFAULT_CACHE_PATH = os.path.join('cache', 'analysis_code.json')
+
+_STRING_LITERAL = re.compile(r"""['"]([^'"\n]+)['"]""")
+
+
+def schema_fingerprint(df):
+    hasher = hashlib.sha256()
+    for col, dtype in df.dtypes.items():
+        hasher.update(f"{col}\0{dtype}\n".encode('utf-8'))
+    return hasher.hexdigest()[:16]
+
+
+def referenced_columns(code, df):
+    # Columns the code names as string literals, with the dtype they had when it ran
+    dtypes = {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+    return {name: dtypes[name] for name in set(_STRING_LITERAL.findall(code)) if name in dtypes}
+
+
+class AnalysisCodeCache:
+    # Stores generated analysis code that has already executed successfully,
+    # keyed on the normalised query, the interpreted parameters and the
+    # DataFrame schema. When the schema changes, entries whose referenced
+    # columns still exist with the same dtypes are carried over; the rest are
+    # dropped. With an LLMHandler, paraphrased queries with identical
+    # parameters can reuse code above a similarity threshold.
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, maxsize=512, llm_handler=None, similarity_threshold=0.9):
+        self.path = path
+        self.maxsize = maxsize
+        self.llm_handler = llm_handler
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._schema = None
+        self._embeddings = {}
+        self._lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable analysis code cache {self.path}: {str(e)}")
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _parameters_key(parameters):
+        return json.dumps(parameters or {}, sort_keys=True, default=str)
+
+    def cache_key(self, query, parameters, schema):
+        hasher = hashlib.sha256()
+        for part in (normalise_query(query), self._parameters_key(parameters), schema):
+            hasher.update(part.encode('utf-8'))
+            hasher.update(b'\0')
+        return hasher.hexdigest()[:32]
+
+    def revalidate(self, df):
+        # Re-key entries built against another schema, or drop them if their columns changed
+        schema = schema_fingerprint(df)
+        if schema == self._schema:
+            return
+        dtypes = {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+        migrated, dropped = {}, 0
+        for key, entry in self.entries.items():
+            if entry['schema'] == schema:
+                migrated[key] = entry
+            elif all(dtypes.get(col) == dtype for col, dtype in entry['columns'].items()):
+                entry['schema'] = schema
+                migrated[self.cache_key(entry['query'], entry['parameters'], schema)] = entry
+            else:
+                dropped += 1
+        if dropped or migrated.keys() != self.entries.keys():
+            logging.info(f"Analysis code cache revalidated for schema {schema}: kept {len(migrated)}, dropped {dropped}")
+            self.entries = migrated
+            self._embeddings = {}
+            self._save()
+        self._schema = schema
+
+    def _embed(self, text):
+        embedding = np.asarray(self.llm_handler.encode_query(text).cpu().numpy(), dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def _similar(self, query, parameters, schema):
+        parameters_key = self._parameters_key(parameters)
+        candidates = [k for k, e in self.entries.items() if e['schema'] == schema and self._parameters_key(e['parameters']) == parameters_key]
+        if not candidates:
+            return None
+        query_embedding = self._embed(normalise_query(query))
+        best_key, best_score = None, self.similarity_threshold
+        for key in candidates:
+            if key not in self._embeddings:
+                self._embeddings[key] = self._embed(normalise_query(self.entries[key]['query']))
+            score = float(self._embeddings[key] @ query_embedding)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, query, parameters, df):
+        # Returns (key, code) for a reusable entry, or (None, None)
+        with self._lock:
+            self.revalidate(df)
+            key = self.cache_key(query, parameters, self._schema)
+            if key in self.entries:
+                self.hits += 1
+            elif self.llm_handler is not None and (similar := self._similar(query, parameters, self._schema)):
+                logging.debug(f"Reusing analysis code of '{self.entries[similar]['query']}' for '{query}'")
+                key = similar
+                self.similar_hits += 1
+            else:
+                self.misses += 1
+                return None, None
+            entry = self.entries[key]
+            entry['hits'] = entry.get('hits', 0) + 1
+            entry['last_used'] = time.time()
+            return key, entry['code']
+
+    def put(self, query, parameters, df, code):
+        with self._lock:
+            self.revalidate(df)
+            key = self.cache_key(query, parameters, self._schema)
+            self.entries[key] = {
+                'query': query,
+                'parameters': parameters or {},
+                'schema': self._schema,
+                'columns': referenced_columns(code, df),
+                'code': code,
+                'created': time.time(),
+                'last_used': time.time(),
+                'hits': 0,
+            }
+            # Evict the least recently used entries beyond maxsize
+            for stale in sorted(self.entries, key=lambda k: self.entries[k]['last_used'])[:max(0, len(self.entries) - self.maxsize)]:
+                del self.entries[stale]
+                self._embeddings.pop(stale, None)
+            self._save()
+            return key
+
+    def discard(self, key):
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self._embeddings.pop(key, None)
+                self._save()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+        }
@@ -1,34 +1,103 @@
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+import contextlib
+import hashlib
 import io
 import base64
+import os
+import re
+import threading
+import time
+import traceback
 import pandas as pd
 
-def extract_and_execute_code(code, df):
-    # Create a local environment with necessary imports and the DataFrame
+# Generated code is told where the raw files live; inside the executor the
+# preprocessed DataFrame is already loaded, so those reads become `df`
+DATA_READ_PATTERN = re.compile(r"""pd\.read_(?:csv|json)\(\s*['"]data/[^'"]+['"][^)]*\)""")
+FIGURE_FORMATS = ('png', 'svg')
+
+# pyplot keeps its figures in process-wide state, so jobs sharing a process take turns
+_plot_lock = threading.Lock()
+_savefig = Figure.savefig
+
+
+def prepare_code(code):
+    return DATA_READ_PATTERN.sub('df', code)
+
+
+def code_key(code, fmt='png'):
+    # Content hash of the code as it will run, plus the figure format
+    return hashlib.sha256(f"{fmt}\n{prepare_code(code)}".encode()).hexdigest()
+
+
+def _savefig_in_memory(fig, fname, *args, **kwargs):
+    # Paths are ignored: every open figure is captured after the job, so
+    # generated code saving to e.g. graphs/result.png no longer shares a file
+    if isinstance(fname, (str, os.PathLike)):
+        return None
+    return _savefig(fig, fname, *args, **kwargs)
+
+
+@contextlib.contextmanager
+def figures_in_memory():
+    Figure.savefig = _savefig_in_memory
+    try:
+        yield
+    finally:
+        Figure.savefig = _savefig
+
+
+def capture_figures(fmt='png'):
+    # Render every open figure to bytes, then close them so the next job starts clean
+    if fmt not in FIGURE_FORMATS:
+        raise ValueError(f"Unsupported figure format {fmt!r}, expected one of {FIGURE_FORMATS}")
+    figures = []
+    for num in plt.get_fignums():
+        buffer = io.BytesIO()
+        plt.figure(num).savefig(buffer, format=fmt, bbox_inches='tight')
+        figures.append(buffer.getvalue())
+    plt.close('all')
+    return figures
+
+
+def extract_and_execute_code(code, df, fmt='png'):
+    # Each job gets a fresh namespace with the necessary imports and the DataFrame
     local_env = {
+        '__name__': '__main__',
         'pd': pd,
         'plt': plt,
         'df': df
     }
-    
-    try:
-        # Execute the code
-        exec(code, local_env)
-        
-        # Capture the plot
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        plot_base64 = base64.b64encode(buffer.getvalue()).decode()
-        plt.close()  # Clear the current plot
-        
-        return {
-            'success': True,
-            'plot': plot_base64,
-            'output': local_env.get('output', '')  # Capture any output variable if defined in the code
-        }
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
\ No newline at end of file
+    stdout = io.StringIO()
+
+    with _plot_lock:
+        try:
+            # Execute the code, capturing anything it prints
+            with contextlib.redirect_stdout(stdout), figures_in_memory():
+                exec(prepare_code(code), local_env)
+
+            # Capture the plots; the time is reported back as the rendering stage
+            render_start = time.perf_counter()
+            figures = capture_figures(fmt)
+            render_seconds = time.perf_counter() - render_start
+            plot_base64 = base64.b64encode(figures[0]).decode() if figures else ''
+
+            return {
+                'success': True,
+                'plot': plot_base64,
+                'figures': figures,
+                'figure_format': fmt,
+                'render_seconds': render_seconds,
+                'stdout': stdout.getvalue(),
+                'output': local_env.get('output', '')  # Capture any output variable if defined in the code
+            }
+        except Exception as e:
+            plt.close('all')
+            return {
+                'success': False,
+                'error': str(e),
+                'traceback': traceback.format_exc(),
+                'stdout': stdout.getvalue()
+            }
@@ -1,30 +1,221 @@
 import json
+import os
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-def load_data(file_path):
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    df = pd.json_normalize(data)
+# Records flattened together; bounds the Python objects alive at any one time
+DEFAULT_CHUNK_SIZE = 50000
+READ_SIZE = 1 << 20
+
+# Date formats used in the exports, e.g. 2021-03-04T00:00:00.000Z and 2021-03-04.
+# %z accepts the trailing Z and keeps pandas on its fast ISO parser, which a
+# literal Z in the format does not.
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%S.%f%z'
+DATE_FORMATS = [ISO_FORMAT, '%Y-%m-%d']
+
+# Repeated strings that are always stored as categoricals
+CATEGORICAL_COLUMNS = [
+    'district', 'district_name', 'town', 'region', 'sector', 'sector_name', 'cc', 'latest_tenure',
+    'postcode_area', 'paf_postcode_type', 'floor_level', 'floor_level_discrete', 'fuel_source', 'heating',
+    'walls', 'roof_type', 'age_band', 'listed_building_grade', 'coordinates.type',
+    'secondary_property_type.epc', 'secondary_property_type.lr', 'secondary_property_type.dvm',
+    'secondary_tenure.listings', 'secondary_tenure.lr', 'secondary_new_build.listings', 'secondary_new_build.lr',
+]
+# Other string columns become categorical when at most this share of values is distinct
+CATEGORICAL_MAX_RATIO = 0.5
+
+def iter_json_records(file_path, read_size=READ_SIZE):
+    # Incrementally parse a top-level JSON array (or JSON Lines) one record at a time
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(read_size)
+        pos = len(buffer) - len(buffer.lstrip())
+        in_array = buffer[pos:pos + 1] == '['
+        if in_array:
+            pos += 1
+        eof = not buffer
+        while True:
+            # Skip separators between records
+            while pos < len(buffer) and (buffer[pos].isspace() or (in_array and buffer[pos] == ',')):
+                pos += 1
+            if pos < len(buffer) and in_array and buffer[pos] == ']':
+                return
+            if pos >= len(buffer):
+                if eof:
+                    return
+                more = f.read(read_size)
+                eof = not more
+                buffer, pos = more, 0
+                continue
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The record continues past the buffered text
+                more = f.read(read_size)
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield record
+            pos = end
+
+def iter_record_chunks(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    chunk = []
+    for record in iter_json_records(file_path):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def flatten_records(records):
+    # Nested MongoDB-style fields become dotted columns, e.g. _id.oid and uprn.numberLong
+    return pd.json_normalize(records)
+
+def map_chunks(func, chunks, workers=1):
+    # Yields func(chunk) in order; with workers > 1 (0 means every core) chunks are
+    # processed in parallel while at most 2 * workers of them are held in memory
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunks:
+            yield func(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for chunk in chunks:
+            pending.append(executor.submit(func, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def load_data(file_path, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    # Streams the export instead of json.load-ing it whole, so the parsed records
+    # never sit in memory at once. The flattened chunk frames are all kept until
+    # the final concat, so peak memory is still about twice the resulting
+    # DataFrame; for exports that don't fit, data_store.ingest_json_chunks
+    # writes each chunk to Parquet instead
+    frames = list(map_chunks(flatten_records, iter_record_chunks(file_path, chunk_size), workers))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def is_date_column(name):
+    # date_created.date, latest_sale_date, epc_date, secondary_latest_sale_date.lr.date, ...
+    # but not update_required
+    return any(part == 'date' or part.endswith('_date') or part.startswith('date_') for part in name.split('.'))
+
+def date_format(values):
+    # The first value decides which known format a column uses
+    first = values.first_valid_index()
+    sample = str(values[first]) if first is not None else ''
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(sample, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return 'ISO8601'
+
+def parse_dates(values):
+    if pd.api.types.is_datetime64_any_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return values
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_datetime(values, errors='coerce')
+    if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        # numpy's C ISO-8601 parser is several times faster than pandas' on clean
+        # columns; anything it rejects goes through pandas below
+        try:
+            text = values.str.removesuffix('Z').fillna('NaT').to_numpy(dtype=object)
+            parsed = pd.Series(np.asarray(text, dtype='datetime64[us]'), index=values.index, name=values.name)
+            return parsed.dt.tz_localize('UTC')
+        except ValueError:
+            pass
+    # One vectorised pass with an explicit format; only rows that miss it are
+    # re-parsed as generic ISO-8601
+    parsed = pd.to_datetime(values, format=date_format(values), errors='coerce', utc=True)
+    missed = parsed.isna().to_numpy() & values.notna().to_numpy()
+    if missed.any():
+        parsed[missed] = pd.to_datetime(values[missed], format='ISO8601', errors='coerce', utc=True)
+    return parsed
+
+def downcast_numeric(values):
+    # Compact numeric type that holds every value exactly. Whole numbers stay
+    # int64: generated analysis code does arithmetic like bedrooms * 1000 on
+    # these columns, which overflows int8/int16 (or wraps silently in arrays)
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype(np.int64)
+    array = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    if len(array) and np.isfinite(array).all() and np.array_equal(array, np.round(array)) and np.abs(array).max() < 2 ** 62:
+        return values.astype(np.int64)
+    # Only narrow to float32 when nothing is lost, so lat/long keep full precision
+    if np.array_equal(array.astype(np.float32).astype(np.float64), array, equal_nan=True):
+        return values.astype(np.float32)
+    return values
+
+def categorize_strings(df):
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            # Mixed object columns cannot be written as Arrow; keep non-null values as text
+            values = values.where(values.isna(), values.astype(str))
+            if col in CATEGORICAL_COLUMNS or values.nunique(dropna=True) <= CATEGORICAL_MAX_RATIO * max(len(values), 1):
+                df[col] = values.astype('category')
+            else:
+                df[col] = values
     return df
 
-def preprocess_data(df):
-    # Convert date columns to datetime
-    date_columns = ['date_created', 'date_updated', 'latest_sale_date']
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-    
-    # Handle missing values in numeric columns
+def optimize_dtypes(df):
+    # Categoricals for repeated strings, compact exact numeric types for numbers
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            df[col] = downcast_numeric(values)
+    return categorize_strings(df)
+
+def normalise_lease_terms(values):
+    # Vectorised parse_lease_term: plain text (the CSV case) is detected with one
+    # C-level scan and returned untouched; only dict/list rows go through Python
+    if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty', 'integer', 'floating', 'mixed-integer-float', 'boolean'):
+        return values
+    nested = values.map(type).isin([dict, list]).to_numpy()
+    if not nested.any():
+        return values
+    result = values.copy()
+    result[nested] = [parse_lease_term(v) for v in values[nested]]
+    return result
+
+def preprocess_data(df, downcast=False):
+    # Convert date columns to datetime, once, with the known export format
+    for col in [c for c in df.columns if is_date_column(c)]:
+        df[col] = parse_dates(df[col])
+
+    # Handle missing values in numeric columns, downcasting in the same pass if asked
     numeric_columns = df.select_dtypes(include=['float64', 'int64']).columns
-    df[numeric_columns] = df[numeric_columns].fillna(0)
-    
+    if downcast:
+        for col in numeric_columns:
+            df[col] = downcast_numeric(df[col].fillna(0))
+    else:
+        df[numeric_columns] = df[numeric_columns].fillna(0)
+
     # Handle the lease_term column
     if 'lease_term' in df.columns:
-        df['lease_term'] = df['lease_term'].apply(parse_lease_term)
-    
+        df['lease_term'] = normalise_lease_terms(df['lease_term'])
+
     return df
 
+def prepare_data(df):
+    # Full preprocessing applied before the app uses the data
+    df = preprocess_data(df, downcast=True)
+    if 'lease_term' in df.columns:
+        df['lease_term'] = df['lease_term'].astype(str)  # Convert lease_term to string
+    return categorize_strings(df)
+
 def parse_lease_term(lease_term):
     if isinstance(lease_term, dict):
         # If it's a dictionary, try to extract relevant information
@@ -0,0 +1,184 @@
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data_loader import (DEFAULT_CHUNK_SIZE, flatten_records, iter_record_chunks, load_data, map_chunks,
+                             prepare_data)
+
+DEFAULT_STORE_PATH = os.path.join('data', 'property_data.feather')
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The columnar data store needs pyarrow; install it with `pip install pyarrow`")
+    return pyarrow
+
+
+def write(df, dest=DEFAULT_STORE_PATH):
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    directory = os.path.dirname(dest)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_path = f"{dest}.{os.getpid()}.tmp"
+    if dest.endswith('.parquet'):
+        pq.write_table(table, tmp_path)
+    else:
+        # Uncompressed Feather in a single record batch, so every numeric column
+        # is one contiguous buffer that load() can use straight from the mapping
+        feather.write_feather(table, tmp_path, compression='uncompressed', chunksize=max(table.num_rows, 1))
+    os.replace(tmp_path, dest)
+
+
+def arrow_safe(df):
+    # Object columns mixing value types (or holding dicts) are written as text
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_object_dtype(values):
+            kinds = values.dropna().map(type).unique()
+            if len(kinds) > 1 or dict in kinds:
+                df[col] = values.where(values.isna(), values.astype(str))
+    return df
+
+
+def _write_chunk(task):
+    records, path = task
+    df = arrow_safe(flatten_records(records))
+    write(df, path)
+    return len(df)
+
+
+def ingest_json_chunks(source, dest_dir, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    # Streams a JSON export into numbered Parquet parts without holding it in memory
+    _require_pyarrow()
+    start = time.perf_counter()
+    os.makedirs(dest_dir, exist_ok=True)
+    for name in os.listdir(dest_dir):
+        if name.startswith('part-') and name.endswith('.parquet'):
+            os.remove(os.path.join(dest_dir, name))
+
+    tasks = ((records, os.path.join(dest_dir, f"part-{i:05d}.parquet")) for i, records in enumerate(iter_record_chunks(source, chunk_size)))
+    rows = sum(map_chunks(_write_chunk, tasks, workers))
+    logging.info(f"Wrote {rows} rows from {source} into {dest_dir} in {time.perf_counter() - start:.1f}s")
+    return rows
+
+
+def load_chunks(dest_dir, columns=None):
+    # Parts may not all carry every column; missing ones come back as NaN
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    frames = []
+    for name in sorted(os.listdir(dest_dir)):
+        if name.startswith('part-') and name.endswith('.parquet'):
+            path = os.path.join(dest_dir, name)
+            present = None if columns is None else [c for c in columns if c in pq.read_schema(path).names]
+            frames.append(pq.read_table(path, columns=present, memory_map=True).to_pandas())
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def ingest(source, dest=DEFAULT_STORE_PATH):
+    # Parse the CSV/JSON export once, preprocess it and write a typed columnar copy
+    _require_pyarrow()
+    start = time.perf_counter()
+    df = load_data(source) if source.endswith('.json') else pd.read_csv(source)
+    before = df.memory_usage(deep=True).sum()
+    df = prepare_data(df)
+    after = df.memory_usage(deep=True).sum()
+    write(df, dest)
+
+    logging.info(f"Ingested {len(df)} rows from {source} into {dest} in {time.perf_counter() - start:.1f}s; "
+                 f"in-memory size {before / 1e6:.1f}MB -> {after / 1e6:.1f}MB")
+    return df
+
+
+def is_stale(source, dest=DEFAULT_STORE_PATH):
+    if not os.path.isfile(dest):
+        return True
+    return os.path.isfile(source) and os.path.getmtime(source) > os.path.getmtime(dest)
+
+
+def load_or_ingest(source, dest=DEFAULT_STORE_PATH):
+    # Preprocessed data from the store, rebuilding it first when the export is newer
+    if not is_stale(source, dest):
+        return load(dest)
+    try:
+        return ingest(source, dest)
+    except ImportError as e:
+        logging.warning(f"Not using the columnar store: {str(e)}")
+        df = load_data(source) if source.endswith('.json') else pd.read_csv(source)
+        return prepare_data(df)
+
+
+def matching_columns(path=DEFAULT_STORE_PATH, names=()):
+    # Store columns that are one of names or nested under one ('secondary_area'
+    # matches 'secondary_area.epc'), read from the schema alone
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if path.endswith('.parquet'):
+        schema = pq.read_schema(path)
+    else:
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    names = set(names)
+    return [c for c in schema.names if c in names or any(c.startswith(f"{name}.") for name in names)]
+
+
+def load(path=DEFAULT_STORE_PATH, columns=None):
+    # Column-projected read. Numeric columns without gaps in a Feather store come
+    # back as read-only views of the memory-mapped file, so processes loading the
+    # same store share those pages; modify a df.copy(deep=False), which copies a
+    # column on first write. Strings, categoricals and Parquet are still decoded.
+    _require_pyarrow()
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    if path.endswith('.parquet'):
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    # Stores written before whole numbers were kept as int64 may hold int8/int16
+    # columns, which overflow in analysis arithmetic
+    for col in df.columns:
+        if pd.api.types.is_integer_dtype(df[col]) and df[col].dtype.itemsize < 8:
+            df[col] = df[col].astype(np.int64)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the property export into a typed columnar store.")
+    parser.add_argument('--source', default='data/property_data.csv', help="CSV or JSON export")
+    parser.add_argument('--dest', default=DEFAULT_STORE_PATH, help="Output .feather or .parquet file")
+    parser.add_argument('--chunks-dir', help="Stream a JSON export into Parquet parts in this directory instead")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=1, help="Processes flattening chunks, 0 for every core")
+    args = parser.parse_args(argv)
+
+    if args.chunks_dir:
+        rows = ingest_json_chunks(args.source, args.chunks_dir, args.chunk_size, args.workers)
+        print(f"Wrote {rows} rows to {args.chunks_dir}")
+        return
+
+    df = ingest(args.source, args.dest)
+    print(f"Wrote {len(df)} rows, {len(df.columns)} columns to {args.dest}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join('cache', 'embeddings')
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Stable row identifiers, in order of preference
+ID_COLUMNS = ['_id.oid', 'uprn.numberLong']
+UPDATED_COLUMN = 'date_updated.date'
+# Update hint of a row without a (parseable) update date; such rows are always hashed
+MISSING_UPDATE = -1
+
+
+class EmbeddingCache:
+    # On-disk store for property embeddings, one directory per model and set of
+    # text columns. Each row is keyed by a stable id plus a fingerprint of its
+    # text, so a reload only encodes new or changed rows and drops deleted
+    # ones. When nothing changed the stored array is memory-mapped as-is, so
+    # restarts skip re-encoding and processes share the same pages.
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, use_update_hint=True):
+        self.cache_dir = cache_dir
+        self.use_update_hint = use_update_hint
+
+    def namespace(self, model_name, text_columns):
+        hasher = hashlib.sha256()
+        hasher.update(model_name.encode('utf-8'))
+        hasher.update(json.dumps(list(text_columns)).encode('utf-8'))
+        return hasher.hexdigest()[:16]
+
+    def _path(self, namespace, name):
+        return os.path.join(self.cache_dir, namespace, name)
+
+    def row_ids(self, df):
+        for col in ID_COLUMNS:
+            if col in df.columns:
+                return pd.util.hash_pandas_object(df[col].astype(str), index=False).to_numpy()
+        # Without an id column rows can only be matched by position
+        return np.arange(len(df), dtype=np.uint64)
+
+    def row_updates(self, df):
+        if not self.use_update_hint or UPDATED_COLUMN not in df.columns:
+            return None
+        updated = pd.to_datetime(df[UPDATED_COLUMN], errors='coerce', utc=True)
+        epoch = pd.Timestamp(0, tz='UTC')
+        return ((updated - epoch) // pd.Timedelta(microseconds=1)).fillna(MISSING_UPDATE).astype(np.int64).to_numpy()
+
+    def fingerprints(self, df, text_columns):
+        texts = df[list(text_columns)].astype(object).fillna('').astype(str)
+        return pd.util.hash_pandas_object(texts, index=False).to_numpy()
+
+    def content_key(self, ids, fingerprints):
+        hasher = hashlib.sha256()
+        hasher.update(np.ascontiguousarray(ids).tobytes())
+        hasher.update(np.ascontiguousarray(fingerprints).tobytes())
+        return hasher.hexdigest()[:32]
+
+    def load(self, namespace):
+        meta_path = self._path(namespace, 'meta.json')
+        if not os.path.isfile(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            stored = {'meta': meta}
+            for name in ('embeddings', 'ids', 'fingerprints', 'updates'):
+                path = self._path(namespace, f"{name}.npy")
+                stored[name] = np.load(path, mmap_mode='r') if os.path.isfile(path) else None
+            for name in ('embeddings', 'ids', 'fingerprints'):
+                if stored[name] is None or len(stored[name]) != meta['rows']:
+                    raise ValueError(f"{name} does not match the stored metadata")
+            return stored
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Discarding unreadable embedding cache {namespace}: {str(e)}")
+            self.invalidate(namespace)
+            return None
+
+    def _write_array(self, namespace, name, array):
+        # Write to a temporary file and rename so readers never see a partial array
+        path = self._path(namespace, f"{name}.npy")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    def save(self, namespace, embeddings, ids, fingerprints, updates=None, metadata=None):
+        os.makedirs(os.path.join(self.cache_dir, namespace), exist_ok=True)
+        # Metadata is removed first and written last, so an interrupted save reads as a miss
+        meta_path = self._path(namespace, 'meta.json')
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self._write_array(namespace, 'embeddings', embeddings)
+        self._write_array(namespace, 'ids', ids)
+        self._write_array(namespace, 'fingerprints', fingerprints)
+        updates_path = self._path(namespace, 'updates.npy')
+        if updates is not None:
+            self._write_array(namespace, 'updates', updates)
+        elif os.path.isfile(updates_path):
+            os.remove(updates_path)
+
+        meta = dict(metadata or {})
+        meta.update({
+            'key': self.content_key(ids, fingerprints),
+            'rows': int(embeddings.shape[0]),
+            'dim': int(embeddings.shape[1]),
+            'created': time.time(),
+        })
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        return np.load(self._path(namespace, 'embeddings.npy'), mmap_mode='r')
+
+    def _stored_positions(self, stored, ids):
+        # Position of every current row in the stored arrays, -1 for new rows
+        stored_ids = pd.Index(np.asarray(stored['ids']))
+        first = ~stored_ids.duplicated()
+        matches = stored_ids[first].get_indexer(ids)
+        return np.where(matches >= 0, np.flatnonzero(first)[matches], -1)
+
+    def get_or_build(self, df, llm_handler):
+        text_columns = llm_handler.text_columns
+        namespace = self.namespace(llm_handler.model_name, text_columns)
+        stored = self.load(namespace)
+        ids = self.row_ids(df)
+        updates = self.row_updates(df)
+
+        if stored is not None:
+            positions = self._stored_positions(stored, ids)
+        else:
+            positions = np.full(len(df), -1)
+        known = positions >= 0
+
+        # Rows whose update date is present and unchanged keep their stored fingerprint
+        fingerprints = np.zeros(len(df), dtype=np.uint64)
+        to_hash = np.ones(len(df), dtype=bool)
+        if updates is not None and stored is not None and stored['updates'] is not None:
+            unchanged = known.copy()
+            unchanged[known] = (np.asarray(stored['updates'])[positions[known]] == updates[known]) & (updates[known] != MISSING_UPDATE)
+            fingerprints[unchanged] = np.asarray(stored['fingerprints'])[positions[unchanged]]
+            to_hash = ~unchanged
+        if to_hash.any():
+            fingerprints[to_hash] = self.fingerprints(df.iloc[np.flatnonzero(to_hash)], text_columns)
+
+        if stored is not None and stored['meta'].get('key') == self.content_key(ids, fingerprints):
+            logging.info(f"Loaded {len(df)} property embeddings from cache {namespace}")
+            return stored['embeddings']
+
+        reuse = known.copy()
+        if stored is not None:
+            reuse[known] = np.asarray(stored['fingerprints'])[positions[known]] == fingerprints[known]
+        stale = np.flatnonzero(~reuse)
+        logging.info(f"Embedding cache {namespace}: reusing {int(reuse.sum())} rows, encoding {len(stale)}")
+
+        encoded = None
+        encoded_path = self._path(namespace, f"encoded.{os.getpid()}.tmp.npy")
+        if len(stale):
+            # Streamed to disk so a full rebuild does not hold every new embedding in memory twice
+            encoded = llm_handler.encode_properties(df.iloc[stale], convert_to_tensor=False, out_path=encoded_path)
+        if encoded is not None:
+            dim = encoded.shape[1]
+        elif stored is not None:
+            dim = stored['meta']['dim']
+        else:
+            dim = 0
+        if stored is not None and reuse.any() and stored['meta']['dim'] != dim:
+            # Model output changed shape, nothing stored can be reused
+            self.invalidate(namespace)
+            return self.get_or_build(df, llm_handler)
+
+        # Rebuild the array in the current row order; deleted rows are not carried over
+        embeddings = np.empty((len(df), dim), dtype=np.float32)
+        if reuse.any():
+            embeddings[reuse] = np.asarray(stored['embeddings'])[positions[reuse]]
+        if encoded is not None:
+            embeddings[stale] = encoded
+
+        saved = self.save(namespace, embeddings, ids, fingerprints, updates, {
+            'model_name': llm_handler.model_name,
+            'text_columns': list(text_columns),
+            'encoded_rows': int(len(stale)),
+        })
+        if os.path.isfile(encoded_path):
+            os.remove(encoded_path)
+        return saved
+
+    def entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return sorted(d for d in os.listdir(self.cache_dir) if os.path.isfile(self._path(d, 'meta.json')))
+
+    def invalidate(self, namespace=None):
+        if namespace is not None:
+            namespaces = [namespace]
+        elif os.path.isdir(self.cache_dir):
+            namespaces = os.listdir(self.cache_dir)
+        else:
+            namespaces = []
+        for ns in namespaces:
+            shutil.rmtree(os.path.join(self.cache_dir, ns), ignore_errors=True)
+        return namespaces
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-build or clear the property embedding cache.")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Encode new or changed properties and store the embeddings")
+    build_parser.add_argument('--data', default='data/property_data.csv')
+    build_parser.add_argument('--model', default=DEFAULT_MODEL_NAME)
+    build_parser.add_argument('--workers', type=int, default=1, help="Encoding processes, 0 for every core")
+
+    subparsers.add_parser('list', help="List cached entries")
+    subparsers.add_parser('clear', help="Remove every cached entry")
+
+    args = parser.parse_args(argv)
+    cache = EmbeddingCache(args.cache_dir)
+
+    if args.command == 'build':
+        from src.llm_handler import LLMHandler
+
+        llm_handler = LLMHandler(args.model, encode_workers=args.workers)
+        header = pd.read_csv(args.data, nrows=0).columns
+        usecols = [c for c in llm_handler.text_columns + ID_COLUMNS + [UPDATED_COLUMN] if c in header]
+        df = pd.read_csv(args.data, usecols=usecols)
+        start = time.perf_counter()
+        embeddings = cache.get_or_build(df, llm_handler)
+        print(f"Cached {embeddings.shape[0]} embeddings in {time.perf_counter() - start:.1f}s")
+    elif args.command == 'list':
+        for namespace in cache.entries():
+            with open(cache._path(namespace, 'meta.json')) as f:
+                print(namespace, json.load(f))
+    elif args.command == 'clear':
+        print(f"Removed {len(cache.invalidate())} cache entries")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,200 @@
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+# Columns searched when the query names a place
+LOCATION_COLUMNS = ['town', 'district', 'district_name', 'region', 'postcode', 'postcode_area', 'sector', 'sector_name', 'street']
+PROPERTY_TYPE_COLUMNS = ['secondary_property_type.epc', 'secondary_property_type.lr', 'secondary_property_type.dvm']
+TENURE_COLUMNS = ['latest_tenure', 'secondary_tenure.lr', 'secondary_tenure.listings']
+
+# Numeric fields, each coalesced from its sources in order of preference
+NUMERIC_FIELDS = {
+    'bedrooms': ['secondary_bedrooms.listings.numberDouble', 'secondary_bedrooms.dvm'],
+    'bathrooms': ['secondary_bathrooms.listings.numberDouble', 'secondary_bathrooms.dvm'],
+    'receptions': ['secondary_receptions.listings.numberDouble', 'secondary_receptions.dvm'],
+    'area': ['secondary_area.listings.numberDouble', 'secondary_area.epc', 'secondary_area.dvm'],
+    'price': ['latest_sale_price'],
+    'price_per_sqft': ['latest_price_ppsqft'],
+    'habitable_rooms': ['habitable_rooms'],
+}
+
+# Fields where a bare number is a budget, so "budget": 500000 means up to
+# 500000 rather than exactly; counts like bedrooms still match exactly
+UPPER_BOUND_FIELDS = {'price', 'price_per_sqft'}
+
+# Parameter names the interpreter is known to produce, mapped to the field they constrain
+PARAMETER_ALIASES = {
+    'bedroom': 'bedrooms', 'beds': 'bedrooms', 'bhk': 'bedrooms',
+    'bathroom': 'bathrooms', 'baths': 'bathrooms',
+    'price': 'price', 'budget': 'price', 'sale_price': 'price', 'latest_sale_price': 'price', 'price_range': 'price',
+    'location': 'location', 'city': 'location', 'town': 'location', 'district': 'location', 'area_name': 'location',
+    'region': 'location', 'postcode': 'location', 'place': 'location', 'locality': 'location',
+    'property_type': 'property_type', 'type': 'property_type', 'house_type': 'property_type',
+    'tenure': 'tenure',
+}
+
+PROPERTY_TYPE_SYNONYMS = {
+    'apartment': 'flat', 'apartments': 'flat', 'flats': 'flat', 'maisonette': 'flat',
+    'houses': 'house', 'home': 'house', 'homes': 'house',
+    'bungalows': 'bungalow', 'detached house': 'detached', 'semi-detached': 'semi_detached',
+    'semi detached': 'semi_detached', 'terraced': 'terrace', 'terraced house': 'terrace',
+}
+
+_AMOUNT = re.compile(r'(\d+(?:\.\d+)?)\s*(k|m|mn|million|thousand)?\b', re.IGNORECASE)
+_MULTIPLIERS = {'k': 1e3, 'thousand': 1e3, 'm': 1e6, 'mn': 1e6, 'million': 1e6}
+
+
+def parse_amount(value):
+    # Accepts 500000, "£500,000", "500k", "1.2m"; returns None when nothing numeric is found
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value)
+    match = _AMOUNT.search(str(value).replace(',', ''))
+    if not match:
+        return None
+    return float(match.group(1)) * _MULTIPLIERS.get((match.group(2) or '').lower(), 1)
+
+
+def parse_range(value, upper_bound=False):
+    # Returns (low, high) for exact values, "a-b" strings, [a, b] lists and {'min', 'max'} dicts.
+    # With upper_bound, a single amount without a direction is a maximum.
+    if isinstance(value, dict):
+        low = next((value[k] for k in ('min', 'from', 'gte', 'low') if value.get(k) is not None), None)
+        high = next((value[k] for k in ('max', 'to', 'lte', 'high') if value.get(k) is not None), None)
+        return parse_amount(low) if low is not None else None, parse_amount(high) if high is not None else None
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return parse_range({'min': value[0], 'max': value[1]})
+    text = str(value).lower()
+    amounts = [parse_amount(m.group(0)) for m in _AMOUNT.finditer(text.replace(',', ''))]
+    if len(amounts) >= 2:
+        return min(amounts[:2]), max(amounts[:2])
+    if not amounts:
+        return None, None
+    if re.search(r'under|below|less than|max|up to|<', text):
+        return None, amounts[0]
+    if re.search(r'over|above|more than|min|at least|\+|>', text):
+        return amounts[0], None
+    return (None, amounts[0]) if upper_bound else (amounts[0], amounts[0])
+
+
+class InvertedIndex:
+    # Lower-cased value -> sorted row positions, built once per column
+
+    def __init__(self, values):
+        values = values.astype('string').str.strip().str.lower()
+        valid = (values.notna() & (values != '')).to_numpy(dtype=bool)
+        codes, uniques = pd.factorize(values[valid])
+        order = np.argsort(codes, kind='stable')
+        positions = np.flatnonzero(valid)[order]
+        bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+        self.postings = dict(zip(uniques, np.split(positions, bounds)))
+
+    def lookup(self, value):
+        return self.postings.get(str(value).strip().lower())
+
+
+class SortedIndex:
+    # Values sorted once so a range predicate is two binary searches
+
+    def __init__(self, values):
+        values = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+        valid = np.flatnonzero(~np.isnan(values))
+        order = np.argsort(values[valid], kind='stable')
+        self.values = values[valid][order]
+        self.positions = valid[order]
+
+    def range(self, low=None, high=None):
+        start = 0 if low is None else np.searchsorted(self.values, low, side='left')
+        stop = len(self.values) if high is None else np.searchsorted(self.values, high, side='right')
+        return np.sort(self.positions[start:stop])
+
+
+class PropertyFilter:
+    # Turns interpreted query parameters into hard column predicates. Each
+    # predicate resolves to sorted row positions from the precomputed indexes,
+    # so similarity ranking only needs to run over the intersection.
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+        self.location = self._inverted(df, LOCATION_COLUMNS)
+        if 'postcode' in df.columns:
+            # Outward codes ("SW1A" of "SW1A 1AA") are a common way to name an area
+            outward = df['postcode'].astype('string').str.split().str[0]
+            self.location['postcode_outward'] = InvertedIndex(outward)
+        self.property_type = self._inverted(df, PROPERTY_TYPE_COLUMNS)
+        self.tenure = self._inverted(df, TENURE_COLUMNS)
+        self.numeric = {}
+        for field, columns in NUMERIC_FIELDS.items():
+            present = [c for c in columns if c in df.columns]
+            if present:
+                self.numeric[field] = SortedIndex(self._coalesce(df, present))
+
+    def _inverted(self, df, columns):
+        return {col: InvertedIndex(df[col]) for col in columns if col in df.columns}
+
+    @staticmethod
+    def _coalesce(df, columns):
+        # preprocess_data fills missing numerics with 0, so 0 counts as unknown here
+        result = pd.Series(np.nan, index=df.index)
+        for col in columns:
+            values = pd.to_numeric(df[col], errors='coerce')
+            result = result.fillna(values.where(values > 0))
+        return result
+
+    @staticmethod
+    def _union(indexes, value):
+        matches = [m for m in (index.lookup(value) for index in indexes.values()) if m is not None]
+        if not matches:
+            return None
+        return np.unique(np.concatenate(matches))
+
+    def locate(self, value):
+        # Row positions whose postcode or place name matches value, or None
+        return self._union(self.location, value)
+
+    def predicates(self, parameters):
+        # Yields (field, row positions) for every parameter that maps to an indexed column
+        for key, value in (parameters or {}).items():
+            if value is None or value == '' or value == []:
+                continue
+            name = str(key).strip().lower().replace(' ', '_')
+            bound = None
+            if name.startswith(('min_', 'max_')):
+                bound, name = name[:3], name[4:]
+            elif name.endswith(('_min', '_max')):
+                bound, name = name[-3:], name[:-4]
+            field = PARAMETER_ALIASES.get(name, name)
+            if field == 'area' and parse_amount(value) is None:
+                # "area" without a number names a place rather than a floor area
+                field = 'location'
+
+            if field in self.numeric:
+                if bound is not None:
+                    amount = parse_amount(value)
+                    low, high = (amount, None) if bound == 'min' else (None, amount)
+                else:
+                    low, high = parse_range(value, upper_bound=field in UPPER_BOUND_FIELDS)
+                if low is None and high is None:
+                    continue
+                yield field, self.numeric[field].range(low, high)
+            elif field in ('location', 'property_type', 'tenure'):
+                indexes = getattr(self, field)
+                values = value if isinstance(value, (list, tuple)) else [value]
+                if field == 'property_type':
+                    values = [PROPERTY_TYPE_SYNONYMS.get(str(v).strip().lower(), v) for v in values]
+                matches = [m for m in (self._union(indexes, v) for v in values) if m is not None]
+                if not matches:
+                    # Free-form values that name nothing in the data are left to similarity ranking
+                    logging.debug(f"No indexed match for {key}={value}, not filtering on it")
+                    continue
+                yield field, np.unique(np.concatenate(matches))
+
+    def candidates(self, parameters):
+        # Sorted row positions satisfying every predicate, or None when nothing constrains the search
+        result = None
+        for field, rows in sorted(self.predicates(parameters), key=lambda p: len(p[1])):
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if len(result) == 0:
+                break
+        return result
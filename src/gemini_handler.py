@@ -1,18 +1,78 @@
+import copy
 import json
 import logging
 import google.generativeai as genai
-import os
-import subprocess
 import pandas as pd
-from typing import Dict
+from typing import Dict, Optional
+from src.cache import TTLCache
+from src.code_executor import extract_and_execute_code
+from src.metrics import metrics
+from src.prompt_builder import AnalysisPromptBuilder
+from src.query_parser import LocalQueryInterpreter, normalise_query
 
 class GeminiHandler:
-    def __init__(self, api_key):
+    def __init__(self, api_key, locations: Optional[Dict[str, str]] = None, cache_size: int = 1024, cache_ttl: float = 3600):
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel('gemini-pro')
-        logging.basicConfig(level=logging.DEBUG)
+        # Common queries are answered locally; the rest are cached by normalised text
+        self.local_interpreter = LocalQueryInterpreter(locations)
+        self.interpretation_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.local_hits = 0
+        # Optional src.analysis_pool.AnalysisPool; without it analyses run in this process
+        self.analysis_pool = None
+        # Optional src.code_cache.AnalysisCodeCache of code that already ran successfully
+        self.code_cache = None
+        # Optional src.aggregate_cube.AggregateCube answering common analyses without Gemini
+        self.aggregate_cube = None
+        # src.prompt_builder.AnalysisPromptBuilder, created from the DataFrame on first use if not set
+        self.prompt_builder = None
 
     def interpret_query(self, query: str) -> Dict:
+        with metrics.span('interpret_query'):
+            interpretation = self.interpret_locally(query)
+            if interpretation is not None:
+                return interpretation
+            return self.interpret_remotely(query)
+
+    def interpret_locally(self, query: str) -> Optional[Dict]:
+        # Cached or rule-based interpretation, or None if the query needs Gemini
+        key = normalise_query(query)
+        cached = self.interpretation_cache.get(key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        local = self.local_interpreter.interpret(query)
+        if local is not None:
+            self.local_hits += 1
+            logging.debug("Interpreted query locally: %s", local)
+            self.interpretation_cache.put(key, local)
+            return copy.deepcopy(local)
+        return None
+
+    def interpret_remotely(self, query: str) -> Dict:
+        # Always asks Gemini; the answer is cached for interpret_locally
+        parsed_response = self._interpret_with_gemini(query)
+        self.interpretation_cache.put(normalise_query(query), parsed_response)
+        return copy.deepcopy(parsed_response)
+
+    def interpretation_stats(self) -> Dict:
+        stats = self.interpretation_cache.stats()
+        stats['local_hits'] = self.local_hits
+        return stats
+
+    def _generate(self, stage: str, prompt: str):
+        # One timed Gemini call, with its token usage counted when the response reports it
+        with metrics.span(stage):
+            response = self.model.generate_content(prompt)
+        metrics.count(f'{stage}_calls')
+        metrics.count(f'{stage}_prompt_chars', len(prompt))
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            metrics.count(f'{stage}_prompt_tokens', getattr(usage, 'prompt_token_count', 0) or 0)
+            metrics.count(f'{stage}_output_tokens', getattr(usage, 'candidates_token_count', 0) or 0)
+        return response
+
+    def _interpret_with_gemini(self, query: str) -> Dict:
         prompt = f"""
         Interpret the following user query about property search or analysis:
         "{query}"
@@ -39,11 +99,16 @@ class GeminiHandler:
         - 10BHK, 10 BHK, 10bhk, 10 bhk: 10 bedrooms
         - 1RK, 1 RK, 1rk, 1 rk: 1 bedroom (considered as a studio apartment)
 
+        For location-based searches ("near X", "within 2km of SW1A 1AA"):
+        - 'near': the postcode, place name or [lat, long] to measure from
+        - 'distance': the radius with its unit, e.g. "2 km" or "1 mile" (omit if none is given)
+
         Ensure that your response is a valid JSON object and nothing else.
         """
         try:
-            logging.debug(f"Sending prompt to Gemini API: {prompt}")
-            response = self.model.generate_content(prompt)
+            # Lazy formatting: the prompt is only rendered when DEBUG logging is on
+            logging.debug("Sending prompt to Gemini API: %s", prompt)
+            response = self._generate('gemini_interpret', prompt)
             response_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
             response_text = response_text.strip()
             
@@ -52,7 +117,7 @@ class GeminiHandler:
             if response_text.endswith('```'):
                 response_text = response_text[:-3].strip()
             
-            logging.debug(f"Cleaned response text: {response_text}")
+            logging.debug("Cleaned response text: %s", response_text)
             
             if not response_text:
                 raise ValueError("Empty response from API")
@@ -65,98 +130,109 @@ class GeminiHandler:
             return parsed_response
         except Exception as e:
             logging.error(f"Error interpreting query: {str(e)}")
-            raise ValueError(f"Error interpreting query: {str(e)}")
+            raise ValueError(f"Error interpreting query: {str(e)}") from e
 
     def generate_and_execute_analysis(self, query: str, parameters: Dict, df: pd.DataFrame) -> Dict:
+        result = self.analyse_locally(query, parameters)
+        if result is not None:
+            return result
+        return self.analyse_remotely(query, parameters, df)
+
+    def analyse_locally(self, query: str, parameters: Dict) -> Optional[Dict]:
+        # Answer from the aggregate cube, or None if the analysis needs generated code
+        if self.aggregate_cube is None:
+            return None
         try:
-            # Generate the code using Gemini
-            prompt = f"""
-            Generate Python code to analyze the following data:
-            {df.head().to_json()}
-
-            The code should perform the analysis based on the query: "{query}"
-            Use print statements to output any relevant analysis results or insights.
-            Ensure that the code includes the necessary imports and saves the plots to the 'graphs' directory.
-            If user want to analyze by using the time in prompts plot the graph then by extracting only years from the columns and the data in column where you need to fetch year, date or anything is of this format %Y-%m-%dT%H:%M:%S.%fZ.
-            Like I tell you if you want to extract year so use like this df['latest_sale_year'] = pd.to_datetime(df['latest_sale_date'], format='%Y-%m-%dT%H:%M:%S.%fZ').dt.year .
-            my data is on location so
-            df = pd.read_csv('data/property_data.csv') 
-            please make sure that if u need data in json format it is present in location 'data/properties.json'
-            and if u need data in csv format it is in location 'data/property_data.csv'
-            so you can write this.
-            Always save the image output with the name result.png as in graphs folder like plt.savefig('graphs/result.png') if result.png already exist overwrite it.
-            these are the columns name in my csv file (address	postcode	street	lat	long	district	cc	active	sector	town	building_number	district_name	sector_name	update_required	building_name	sub_building_name	latest_sale_price	latest_price_ppsqft	epc_reference	epc_date	avm	avm_accuracy	latest_new_build	latest_tenure	latest_lr_reference	snl	habitable_rooms	tci_avm	tci_accuracy	floor_level	lease_term	locked	region	paf_postcode	paf_postcode_type	paf_udprn	paf_address_key	paf_locality_key	postcode_area	rpp_key	water_proximity_400	floor_level_discrete	fuel_source	heating	walls	listed_building_grade	roof_type	tree_proximity_10	tree_proximity_5	age_band	_id.oid	uprn.numberLong	main_reference.numberLong	secondary_bedrooms.listings.numberDouble	secondary_bedrooms.dvm	secondary_bathrooms.listings.numberDouble	secondary_bathrooms.dvm	secondary_receptions.listings.numberDouble	secondary_receptions.dvm	secondary_area.listings.numberDouble	secondary_area.epc	secondary_area.dvm	secondary_property_type.epc	secondary_property_type.lr	secondary_property_type.listings.numberDouble	secondary_property_type.dvm	secondary_num_floors.epc.numberDouble	secondary_num_floors.dvm.numberDouble	secondary_latest_sale_date.lr.date	secondary_latest_sale_date.listings.numberDouble	secondary_latest_sale_price.lr	secondary_latest_sale_price.listings.$numberDouble	secondary_new_build.listings	secondary_new_build.lr	secondary_tenure.listings	secondary_tenure.lr	coordinates.type	coordinates.coordinates	latest_sale_date	epc_values.current_energy_efficiency	epc_values.potential_energy_efficiency	epc_values.environment_impact_current	epc_values.environment_impact_potential	date_created.date	date_updated.date	street_reference.numberLong	building_reference.numberLong	secondary_sub_property_type.dvm.numberDouble	secondary_sub_property_type.epc.numberDouble	secondary_sub_property_type.listings.numberDouble
-)
-            """
-            logging.debug(f"Sending prompt to Gemini API: {prompt}")
-            response = self.model.generate_content(prompt)
-            response_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
-            response_text = response_text.strip()
-            
-            if response_text.startswith('```python'):
-                response_text = response_text[7:].strip()
-            if response_text.endswith('```'):
-                response_text = response_text[:-3].strip()
-            
-            logging.debug(f"Generated code: {response_text}")
-
-            code = response_text
-            lines = code.splitlines()
-
-            # Initialize a flag to track if the line containing "on" has been removed
-            removed = False
-
-            # Create a new list to hold the modified lines
-            new_lines = []
-
-            # Iterate through each line
-            for line in lines:
-                if "on" in line and not removed:
-                    removed = True  # Set the flag to indicate we've removed the line
-                    continue  # Skip this line
-                new_lines.append(line)  # Add the line to the new list
-
-            # Join the modified lines back into a single string
-            modified_code = "\n".join(new_lines)
-
-
-
-
-
-
-
-            # print(response_text)
-            # Remove lines containing "on"
-            # code_lines = response_text
-            # code_lines = code_lines[1:] if code_lines[0].startswith("on") else code_lines
-
-            # Join the modified lines back into a single string
-            # modified_code = "\n".join(code_lines)
-            cleaned_code = modified_code
-           
-
-            # Save the cleaned code to temp.py
-            with open('temp.py', 'w') as f:
-                # f.write("import pandas as pd\n")
-                # f.write("import matplotlib.pyplot as plt\n")
-                # f.write(f"df = pd.read_json('data/properties.json')\n")
-                f.write(cleaned_code)
-            
-            # Execute the generated code
-            result = subprocess.run(['python', 'temp.py'], capture_output=True, text=True)
-
-            if result.returncode != 0:
-                raise RuntimeError(f"Error executing temp.py: {result.stderr}")
+            with metrics.span('cube_answer'):
+                return self.aggregate_cube.answer(query, parameters)
+        except Exception as e:
+            logging.warning(f"Aggregate cube could not answer, generating code: {str(e)}")
+            return None
 
-            # Collect all generated plot files
-            plot_files = [os.path.join('graphs', f) for f in os.listdir('graphs') if f.endswith('.png')]
-            
-            return {
-                'plot_files': plot_files,
-                'code': cleaned_code,
-                'output': result.stdout,
-                'error': result.stderr
-            }
+    def analyse_remotely(self, query: str, parameters: Dict, df: pd.DataFrame) -> Dict:
+        try:
+            if self.code_cache is not None:
+                cache_key, cached_code = self.code_cache.get(query, parameters, df)
+                if cached_code is not None:
+                    try:
+                        result = self._execute_analysis_code(cached_code, df)
+                        result['cached'] = True
+                        return result
+                    except Exception as e:
+                        # Stale code is dropped and regenerated below
+                        logging.warning(f"Cached analysis code failed, regenerating: {str(e)}")
+                        self.code_cache.discard(cache_key)
+
+            cleaned_code = self._generate_analysis_code(query, parameters, df)
+            result = self._execute_analysis_code(cleaned_code, df)
+            if self.code_cache is not None:
+                self.code_cache.put(query, parameters, df, cleaned_code)
+            return result
         except Exception as e:
             logging.error(f"Error generating and executing analysis: {str(e)}")
-            raise ValueError(f"Error generating and executing analysis: {str(e)}")
+            raise ValueError(f"Error generating and executing analysis: {str(e)}") from e
+
+    def _generate_analysis_code(self, query: str, parameters: Dict, df: pd.DataFrame) -> str:
+        # The prompt describes only the columns relevant to the query
+        if self.prompt_builder is None:
+            self.prompt_builder = AnalysisPromptBuilder(df)
+        elif self.prompt_builder.df is not df:
+            self.prompt_builder.reload(df)
+        with metrics.span('build_prompt'):
+            prompt = self.prompt_builder.build(query, parameters)
+
+        # Generate the code using Gemini
+        logging.debug("Sending prompt to Gemini API: %s", prompt)
+        response = self._generate('codegen', prompt)
+        response_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
+        response_text = response_text.strip()
+        
+        if response_text.startswith('```python'):
+            response_text = response_text[len('```python'):].strip()
+        elif response_text.startswith('```'):
+            response_text = response_text[3:].strip()
+        if response_text.endswith('```'):
+            response_text = response_text[:-3].strip()
+        
+        logging.debug("Generated code: %s", response_text)
+        return response_text
+
+    def analysis_prompt_stats(self) -> Dict:
+        stats = self.prompt_builder.stats() if self.prompt_builder is not None else {}
+        codegen = metrics.summary(collect=False)['stages'].get('codegen', {})
+        stats['gemini_calls'] = codegen.get('count', 0)
+        stats['mean_gemini_seconds'] = round(codegen.get('mean_ms', 0.0) / 1000, 2)
+        return stats
+
+    def pipeline_stats(self) -> Dict:
+        # Stats of the caches and optional components in use, for the sidebar and metrics export
+        stats = {'interpretation_cache': self.interpretation_stats(), 'analysis_prompts': self.analysis_prompt_stats()}
+        if self.code_cache is not None:
+            stats['code_cache'] = self.code_cache.stats()
+        if self.aggregate_cube is not None:
+            stats['aggregate_cube'] = self.aggregate_cube.stats()
+        if self.analysis_pool is not None:
+            stats['render_cache'] = self.analysis_pool.render_cache.stats()
+        return stats
+
+    def _execute_analysis_code(self, cleaned_code: str, df: pd.DataFrame) -> Dict:
+        with metrics.span('execution'):
+            if self.analysis_pool is not None:
+                # Run in a pre-warmed worker that already holds the DataFrame
+                result = self.analysis_pool.run(cleaned_code)
+            else:
+                # In this process, in a namespace of its own; figures stay in memory
+                result = extract_and_execute_code(cleaned_code, df.copy(deep=False))
+        if result.get('render_seconds') is not None and not result.get('render_cached'):
+            # Measured where the figures were drawn, possibly in a pool worker
+            metrics.observe('render', result['render_seconds'])
+        if not result['success']:
+            raise RuntimeError(f"Error executing analysis code: {result.get('traceback') or result['error']}")
+        return {
+            'figures': result['figures'],
+            'figure_format': result.get('figure_format', 'png'),
+            'code': cleaned_code,
+            'output': result['stdout'],
+            'error': '',
+            'render_cached': result.get('render_cached', False),
+        }
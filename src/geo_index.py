@@ -0,0 +1,251 @@
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+# Grid cell edge; radius queries scan the cells overlapping the circle's bounding box
+DEFAULT_CELL_KM = 1.0
+# Rows ranked by similarity for "near X" queries that give no distance
+NEAR_CANDIDATES = 200
+
+# Parameter names the interpreter may use for spatial constraints
+NEAR_KEYS = ['near', 'anchor', 'anchor_postcode', 'near_postcode', 'close_to', 'around', 'nearby']
+DISTANCE_KEYS = ['distance', 'radius', 'within', 'max_distance', 'distance_km', 'radius_km']
+BBOX_KEYS = ['bbox', 'bounds', 'bounding_box']
+LAT_KEYS = ['lat', 'latitude']
+LON_KEYS = ['long', 'lon', 'lng', 'longitude']
+# Used as the anchor when only a distance is given
+ANCHOR_FALLBACK_KEYS = ['postcode', 'location', 'town', 'district', 'place']
+
+_DISTANCE = re.compile(r'(\d+(?:\.\d+)?)\s*(km|kms|kilomet(?:re|er)s?|miles?|mi|metres?|meters?|m)?\b', re.IGNORECASE)
+_DISTANCE_UNITS = {'m': 0.001, 'metre': 0.001, 'metres': 0.001, 'meter': 0.001, 'meters': 0.001,
+                   'mi': 1.609344, 'mile': 1.609344, 'miles': 1.609344}
+_COORDINATE_PAIR = r'(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)'
+_FULL_POSTCODE = re.compile(r'^\s*([a-z]{1,2}\d[a-z\d]?)\s*(\d)[a-z]{2}\s*$', re.IGNORECASE)
+
+
+def parse_distance(value):
+    # Kilometres from 2, "2km", "1.5 miles", "500m"; None when nothing numeric is found
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value)
+    match = _DISTANCE.search(str(value))
+    if not match:
+        return None
+    return float(match.group(1)) * _DISTANCE_UNITS.get((match.group(2) or 'km').lower(), 1.0)
+
+
+def haversine_km(lat, lon, lats, lons):
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def coordinates(df):
+    # (lat, long) arrays from the lat/long columns, falling back to the GeoJSON
+    # coordinates.coordinates pair ([long, lat]). Missing values are NaN.
+    n = len(df)
+    lat = pd.to_numeric(df['lat'], errors='coerce').to_numpy(dtype=np.float64, copy=True) if 'lat' in df.columns else np.full(n, np.nan)
+    lon = pd.to_numeric(df['long'], errors='coerce').to_numpy(dtype=np.float64, copy=True) if 'long' in df.columns else np.full(n, np.nan)
+    # preprocess_data fills missing numbers with 0, which is not a UK location
+    missing = ~np.isfinite(lat) | ~np.isfinite(lon) | ((lat == 0) & (lon == 0))
+    if missing.any() and 'coordinates.coordinates' in df.columns:
+        pairs = df['coordinates.coordinates'].iloc[np.flatnonzero(missing)]
+        pairs = pairs.map(lambda v: ', '.join(map(str, v)) if isinstance(v, (list, tuple)) else v)
+        extracted = pairs.astype('string').str.extract(_COORDINATE_PAIR).apply(pd.to_numeric, errors='coerce')
+        lon[missing] = extracted[0].to_numpy(dtype=np.float64, na_value=np.nan)
+        lat[missing] = extracted[1].to_numpy(dtype=np.float64, na_value=np.nan)
+    invalid = ~np.isfinite(lat) | ~np.isfinite(lon) | (np.abs(lat) > 90) | (np.abs(lon) > 180) | ((lat == 0) & (lon == 0))
+    lat[invalid] = np.nan
+    lon[invalid] = np.nan
+    return lat, lon
+
+
+def split_parameters(parameters):
+    # Separates spatial constraints from the rest of the interpreted parameters.
+    # Returns (spatial, remaining); spatial has 'anchor', 'radius_km' and 'bbox'.
+    remaining = {}
+    spatial = {'anchor': None, 'radius_km': None, 'bbox': None}
+    lat = lon = None
+    near = False
+    for key, value in (parameters or {}).items():
+        name = str(key).strip().lower().replace(' ', '_')
+        if value is None or value == '':
+            remaining[key] = value
+        elif name in NEAR_KEYS:
+            # Either the anchor itself or a flag saying the location is one
+            if value is True or str(value).lower() == 'true':
+                near = True
+            else:
+                spatial['anchor'] = value
+        elif name in DISTANCE_KEYS and parse_distance(value) is not None:
+            spatial['radius_km'] = parse_distance(value)
+        elif name in BBOX_KEYS:
+            spatial['bbox'] = value
+        elif name in LAT_KEYS:
+            lat = value
+        elif name in LON_KEYS:
+            lon = value
+        else:
+            remaining[key] = value
+    if spatial['anchor'] is None and lat is not None and lon is not None:
+        spatial['anchor'] = [lat, lon]
+    if spatial['anchor'] is None and (near or spatial['radius_km'] is not None):
+        # "within 2km of SW1A 1AA" may arrive as a plain postcode or location
+        for key in list(remaining):
+            if str(key).strip().lower() in ANCHOR_FALLBACK_KEYS:
+                spatial['anchor'] = remaining.pop(key)
+                break
+    if spatial['anchor'] is None and spatial['bbox'] is None:
+        # A distance with nothing to measure from is not a constraint
+        return None, {k: v for k, v in (parameters or {}).items() if str(k).strip().lower() not in NEAR_KEYS}
+    return spatial, remaining
+
+
+def postcode_fallbacks(value):
+    # Broader areas to anchor on when a full postcode isn't in the data:
+    # 'SW1A 1AA' -> ['SW1A 1', 'SW1A'] (its sector, then its outward code)
+    match = _FULL_POSTCODE.match(str(value))
+    if not match:
+        return []
+    outward = match.group(1).upper()
+    return [f"{outward} {match.group(2)}", outward]
+
+
+def parse_point(value):
+    # (lat, long) from [lat, long], {'lat': .., 'long': ..} or "51.5, -0.12"; None otherwise
+    if isinstance(value, dict):
+        lat = next((value[k] for k in LAT_KEYS if k in value), None)
+        lon = next((value[k] for k in LON_KEYS if k in value), None)
+        value = None if lat is None or lon is None else [lat, lon]
+    if isinstance(value, str):
+        match = re.fullmatch(r'\s*' + _COORDINATE_PAIR + r'\s*', value)
+        value = [match.group(1), match.group(2)] if match else None
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        try:
+            lat, lon = float(value[0]), float(value[1])
+        except (TypeError, ValueError):
+            return None
+        if abs(lat) <= 90 and abs(lon) <= 180:
+            return lat, lon
+    return None
+
+
+def parse_bbox(value):
+    # (min_lat, min_long, max_lat, max_long) from a 4-item list or a dict of bounds
+    if isinstance(value, dict):
+        value = [value.get(k) for k in ('min_lat', 'min_long', 'max_lat', 'max_long')]
+    if isinstance(value, str):
+        value = re.findall(r'-?\d+(?:\.\d+)?', value)
+    if not isinstance(value, (list, tuple)) or len(value) != 4:
+        return None
+    try:
+        min_lat, min_lon, max_lat, max_lon = map(float, value)
+    except (TypeError, ValueError):
+        return None
+    return min(min_lat, max_lat), min(min_lon, max_lon), max(min_lat, max_lat), max(min_lon, max_lon)
+
+
+class GeoIndex:
+    # Uniform lat/long grid over the properties. Rows are sorted by cell, so a
+    # bounding box is one binary search per grid row; radius and k-nearest
+    # queries refine the boxed rows with exact haversine distances.
+
+    def __init__(self, lat, lon, cell_km=DEFAULT_CELL_KM):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.lon_cells = int(np.ceil(360 / self.cell_deg)) + 2
+        positions = np.flatnonzero(np.isfinite(self.lat) & np.isfinite(self.lon))
+        keys = self._keys(self.lat[positions], self.lon[positions])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.positions = positions[order]
+
+    @classmethod
+    def from_frame(cls, df, cell_km=DEFAULT_CELL_KM):
+        return cls(*coordinates(df), cell_km=cell_km)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _cell(self, degrees):
+        return np.floor(np.asarray(degrees) / self.cell_deg).astype(np.int64)
+
+    def _keys(self, lat, lon):
+        return self._cell(lat) * self.lon_cells + self._cell(np.asarray(lon) + 180)
+
+    def distances(self, lat, lon, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        return haversine_km(lat, lon, self.lat[positions], self.lon[positions])
+
+    def centroid(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        lat, lon = self.lat[positions], self.lon[positions]
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        if not valid.any():
+            return None
+        return float(lat[valid].mean()), float(lon[valid].mean())
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        # Sorted positions inside the box
+        min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+        min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+        if min_lat > max_lat or min_lon > max_lon or not len(self.positions):
+            return np.empty(0, dtype=np.int64)
+        first_col, last_col = self._cell(min_lon + 180), self._cell(max_lon + 180)
+        slices = []
+        for row in range(int(self._cell(min_lat)), int(self._cell(max_lat)) + 1):
+            start = np.searchsorted(self.keys, row * self.lon_cells + first_col, side='left')
+            stop = np.searchsorted(self.keys, row * self.lon_cells + last_col, side='right')
+            if stop > start:
+                slices.append(self.positions[start:stop])
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate(slices)
+        lat, lon = self.lat[rows], self.lon[rows]
+        inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        return np.sort(rows[inside])
+
+    def radius(self, lat, lon, km):
+        # Sorted positions within km of (lat, lon)
+        dlat = km / KM_PER_DEGREE
+        dlon = km / (KM_PER_DEGREE * max(np.cos(np.radians(min(90.0, abs(lat) + dlat))), 1e-6))
+        rows = self.bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        return rows[self.distances(lat, lon, rows) <= km]
+
+    def nearest(self, lat, lon, k, candidates=None):
+        # Up to k positions ordered by distance, optionally only among candidates
+        if candidates is not None:
+            rows = np.asarray(candidates, dtype=np.int64)
+            rows = rows[np.isfinite(self.lat[rows])]
+        else:
+            # Grow the search circle until it holds k rows
+            km = self.cell_km
+            rows = self.radius(lat, lon, km)
+            while len(rows) < k and km < np.pi * EARTH_RADIUS_KM:
+                km *= 2
+                rows = self.radius(lat, lon, km)
+        distances = self.distances(lat, lon, rows)
+        k = min(k, len(rows))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(distances, k - 1)[:k]
+        return rows[top[np.argsort(distances[top], kind='stable')]]
+
+    def resolve_anchor(self, anchor, locate):
+        # (lat, long) of an anchor given as coordinates, or as a postcode or place
+        # name that locate() turns into row positions; None if it is unknown
+        point = parse_point(anchor)
+        if point is not None:
+            return point
+        names = anchor if isinstance(anchor, (list, tuple)) else [anchor]
+        for name in names:
+            positions = locate(name)
+            if positions is not None and len(positions):
+                return self.centroid(positions)
+        logging.debug(f"Could not locate spatial anchor {anchor}")
+        return None
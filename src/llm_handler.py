@@ -1,20 +1,49 @@
 from sentence_transformers import SentenceTransformer
+import numpy as np
 import torch
 
+from src.bulk_encoder import DEFAULT_CHUNK_SIZE, TEXT_COLUMNS, BulkEncoder, property_texts
+
+
 class LLMHandler:
-    def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, model_name='all-MiniLM-L6-v2', encode_workers=1, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        self.model_name = model_name
+        self.text_columns = TEXT_COLUMNS
+        self.model = SentenceTransformer(model_name)
+        # encode_workers > 1 encodes properties across that many CPU processes, 0 for every core
+        self.bulk_encoder = BulkEncoder(model_name, self.model, workers=encode_workers, chunk_size=chunk_size, progress=progress)
 
     def encode_query(self, query):
         return self.model.encode(query, convert_to_tensor=True)
 
-    def encode_properties(self, df):
+    def encode_queries(self, queries, batch_size=64):
+        # One forward pass for many queries; row i is the embedding of queries[i]
+        return self.model.encode(list(queries), batch_size=batch_size, convert_to_tensor=True)
+
+    def property_texts(self, df):
         # Create a combined string of all available text columns
-        text_columns = ['address', 'postcode', 'district', 'sector', 'town', 'region']
-        property_texts = df[text_columns].fillna('').agg(' '.join, axis=1).tolist()
-        return self.model.encode(property_texts, convert_to_tensor=True)
+        return property_texts(df, self.text_columns).tolist()
+
+    def encode_properties(self, df, convert_to_tensor=True, out_path=None):
+        # With out_path the embeddings are written to a memory-mapped .npy file as they are encoded
+        embeddings = self.bulk_encoder.encode(property_texts(df, self.text_columns), out_path=out_path)
+        if convert_to_tensor:
+            return torch.as_tensor(np.asarray(embeddings), device=self.model.device)
+        return embeddings
+
+    def search_properties(self, query_embedding, property_embeddings, top_k=5, candidates=None):
+        # candidates optionally restricts ranking to these row positions
+        # A prebuilt index from src.vector_index handles normalisation and top-k selection itself
+        if hasattr(property_embeddings, 'search'):
+            return property_embeddings.search(query_embedding.cpu().numpy(), top_k, candidates=candidates).tolist()
 
-    def search_properties(self, query_embedding, property_embeddings, top_k=5):
+        # Cached embeddings arrive as (memory-mapped) numpy arrays
+        property_embeddings = torch.as_tensor(property_embeddings)
+        if candidates is not None:
+            candidates = torch.as_tensor(candidates, dtype=torch.long)
+            property_embeddings = property_embeddings[candidates]
         similarities = torch.cosine_similarity(query_embedding.unsqueeze(0), property_embeddings)
-        top_indices = similarities.argsort(descending=True)[:top_k]
-        return top_indices.tolist()
\ No newline at end of file
+        top_indices = similarities.topk(min(top_k, len(similarities))).indices
+        if candidates is not None:
+            top_indices = candidates[top_indices]
+        return top_indices.tolist()
@@ -0,0 +1,209 @@
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Recent durations kept per stage for the p50/p99 estimates
+MAX_SAMPLES = 2048
+QUANTILES = (0.5, 0.9, 0.99)
+METRIC_PREFIX = 'dpas'
+DEFAULT_PROFILE_DIR = 'profiles'
+PROFILE_TOP_FUNCTIONS = 25
+
+_METRIC_NAME = re.compile(r'[^a-zA-Z0-9_]')
+# cProfile can't nest, and on Python 3.12+ only one profiler may be active per process
+_profile_lock = threading.Lock()
+
+
+def metric_name(*parts):
+    return _METRIC_NAME.sub('_', '_'.join(str(p) for p in parts if p != '')).lower()
+
+
+def _flatten(stats, prefix=''):
+    # {'code_cache': {'hits': 3}} -> {'code_cache_hits': 3}; non-numeric values are dropped
+    flat = {}
+    for key, value in stats.items():
+        name = metric_name(prefix, key)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (bool, int, float, np.number)) and np.isfinite(value):
+            flat[name] = float(value)
+    return flat
+
+
+class Stage:
+    # Count, total and recent durations of one pipeline stage
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def observe(self, seconds, error=False):
+        self.count += 1
+        self.errors += bool(error)
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.samples.append(seconds)
+
+    def quantiles(self):
+        if not self.samples:
+            return {q: 0.0 for q in QUANTILES}
+        return dict(zip(QUANTILES, np.quantile(np.fromiter(self.samples, dtype=np.float64), QUANTILES).tolist()))
+
+    def summary(self):
+        quantiles = self.quantiles()
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': round(self.seconds / self.count * 1000, 2) if self.count else 0.0,
+            'p50_ms': round(quantiles[0.5] * 1000, 2),
+            'p99_ms': round(quantiles[0.99] * 1000, 2),
+            'max_ms': round(self.max_seconds * 1000, 2),
+            'total_s': round(self.seconds, 3),
+        }
+
+
+class Metrics:
+    # Thread-safe registry of per-stage timings and counters for the query
+    # pipeline. Stages are timed with span(); counters (cache hits, Gemini
+    # tokens) with count(); components with their own stats() are registered
+    # as collectors and read at export time. Everything is exported as
+    # Prometheus text, and each span can also be appended to a JSON-lines file.
+
+    def __init__(self, events_path=None):
+        self.events_path = events_path
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.collectors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, error=False, **labels):
+        with self._lock:
+            self.stages.setdefault(stage, Stage()).observe(seconds, error)
+            if self.events_path:
+                event = {'ts': round(time.time(), 6), 'stage': stage, 'ms': round(seconds * 1000, 3), 'error': error}
+                event.update(labels)
+                with open(self.events_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, default=str) + '\n')
+
+    @contextlib.contextmanager
+    def span(self, stage, **labels):
+        # with metrics.span('encode_query'): ... records the block's duration,
+        # counting it as an error if it raises
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, error, **labels)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def register(self, name, collector):
+        # collector() returns a (possibly nested) dict of numbers, e.g. a cache's stats()
+        with self._lock:
+            self.collectors[name] = collector
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def _collected(self):
+        with self._lock:
+            collectors = list(self.collectors.items())
+        gauges = {}
+        for name, collector in collectors:
+            try:
+                gauges.update(_flatten(collector()))
+            except Exception as e:
+                logging.warning(f"Metrics collector {name} failed: {str(e)}")
+        return gauges
+
+    def summary(self, collect=True):
+        with self._lock:
+            stages = {name: stage.summary() for name, stage in self.stages.items()}
+            counters = dict(self.counters)
+        summary = {'uptime_s': round(time.time() - self.started, 1), 'stages': stages, 'counters': counters}
+        if collect:
+            summary['gauges'] = self._collected()
+        return summary
+
+    def prometheus(self):
+        # Text exposition format, served at GET /metrics by src.service
+        stage_metric = metric_name(METRIC_PREFIX, 'stage_seconds')
+        error_metric = metric_name(METRIC_PREFIX, 'stage_errors_total')
+        lines = [f"# HELP {stage_metric} Duration of each query pipeline stage.", f"# TYPE {stage_metric} summary"]
+        with self._lock:
+            stages = {name: (stage.quantiles(), stage.count, stage.seconds, stage.errors) for name, stage in self.stages.items()}
+            counters = dict(self.counters)
+        for name, (quantiles, count, seconds, _) in sorted(stages.items()):
+            for q, value in quantiles.items():
+                lines.append(f'{stage_metric}{{stage="{name}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{stage_metric}_sum{{stage="{name}"}} {seconds:.6f}')
+            lines.append(f'{stage_metric}_count{{stage="{name}"}} {count}')
+        lines += [f"# HELP {error_metric} Pipeline stages that raised.", f"# TYPE {error_metric} counter"]
+        for name, (_, _, _, errors) in sorted(stages.items()):
+            lines.append(f'{error_metric}{{stage="{name}"}} {errors}')
+        for name, value in sorted(counters.items()):
+            metric = metric_name(METRIC_PREFIX, name, 'total')
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in sorted(self._collected().items()):
+            metric = metric_name(METRIC_PREFIX, name)
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value:g}"]
+        return '\n'.join(lines) + '\n'
+
+    @contextlib.contextmanager
+    def profile(self, name, enabled=True, directory=DEFAULT_PROFILE_DIR):
+        # Opt-in cProfile of one request. Yields a dict that is filled after the
+        # block with the .prof path (open with pstats, snakeviz or
+        # `python -m pstats`) and the top functions by cumulative time. Only one
+        # profile runs at a time; a request arriving during another is not profiled.
+        # For sampling without cProfile's overhead, attach py-spy to the logged pid.
+        report = {}
+        if not enabled or not _profile_lock.acquire(blocking=False):
+            if enabled:
+                logging.info(f"Not profiling {name}: another profile is running")
+            yield report
+            return
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                yield report
+            finally:
+                profiler.disable()
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{metric_name(name)}.prof")
+            profiler.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+            report.update({'path': path, 'seconds': round(time.perf_counter() - start, 3), 'top': text.getvalue()})
+            self.count('profiles')
+            logging.info(f"Profiled {name} (pid {os.getpid()}) in {report['seconds']}s, written to {path}")
+        finally:
+            _profile_lock.release()
+
+
+# Process-wide registry shared by the handlers, the Streamlit app and the service
+metrics = Metrics()
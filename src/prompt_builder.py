@@ -0,0 +1,205 @@
+import logging
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.query_parser import normalise_query
+
+# Columns described in every prompt, when present
+CORE_COLUMNS = ['latest_sale_price', 'latest_sale_date', 'district', 'town']
+DEFAULT_MAX_COLUMNS = 16
+# Embedding similarity a column needs to be picked without a keyword match
+MIN_SIMILARITY = 0.35
+# Rows read to estimate cardinality and example values of each column
+SUMMARY_SAMPLE_ROWS = 50000
+MAX_TOP_VALUES = 5
+LOW_CARDINALITY = 20
+
+# Query words that stand for columns whose names don't contain them
+KEYWORD_COLUMNS = {
+    'price': ['latest_sale_price', 'latest_price_ppsqft'], 'prices': ['latest_sale_price', 'latest_price_ppsqft'],
+    'cost': ['latest_sale_price'], 'expensive': ['latest_sale_price'], 'cheap': ['latest_sale_price'],
+    'valuation': ['avm', 'tci_avm'], 'value': ['avm', 'latest_sale_price'],
+    'sqft': ['latest_price_ppsqft'], 'ppsqft': ['latest_price_ppsqft'], 'psf': ['latest_price_ppsqft'],
+    'size': ['secondary_area'], 'bhk': ['secondary_bedrooms'], 'beds': ['secondary_bedrooms'],
+    'bedroom': ['secondary_bedrooms'], 'bedrooms': ['secondary_bedrooms'],
+    'bathroom': ['secondary_bathrooms'], 'bathrooms': ['secondary_bathrooms'],
+    'type': ['secondary_property_type'], 'types': ['secondary_property_type'], 'flat': ['secondary_property_type'],
+    'flats': ['secondary_property_type'], 'apartment': ['secondary_property_type'],
+    'apartments': ['secondary_property_type'], 'house': ['secondary_property_type'], 'houses': ['secondary_property_type'],
+    'detached': ['secondary_property_type'], 'bungalow': ['secondary_property_type'],
+    'freehold': ['latest_tenure'], 'leasehold': ['latest_tenure', 'lease_term'],
+    'year': ['latest_sale_date'], 'years': ['latest_sale_date'], 'yearly': ['latest_sale_date'],
+    'quarter': ['latest_sale_date'], 'quarterly': ['latest_sale_date'], 'month': ['latest_sale_date'],
+    'monthly': ['latest_sale_date'], 'time': ['latest_sale_date'], 'trend': ['latest_sale_date'],
+    'trends': ['latest_sale_date'], 'sold': ['latest_sale_date', 'latest_sale_price'],
+    'sales': ['latest_sale_date', 'latest_sale_price'], 'energy': ['epc_values'], 'efficiency': ['epc_values'],
+    'new': ['latest_new_build'], 'city': ['town'], 'cities': ['town'], 'area': ['district', 'secondary_area'],
+    'areas': ['district'], 'location': ['district', 'town', 'region'], 'map': ['lat', 'long'],
+    'old': ['age_band'], 'built': ['age_band'], 'storey': ['floor_level'], 'floors': ['secondary_num_floors'],
+}
+# Name parts too generic to match on
+GENERIC_NAME_PARTS = {'secondary', 'latest', 'listings', 'dvm', 'epc', 'lr', 'number', 'double', 'long', 'oid',
+                      'numberdouble', 'numberlong', 'reference', 'key', 'values', 'date', 'sub', 'property'}
+
+_NAME_PARTS = re.compile(r'[a-z]+|\d+')
+_WORDS = re.compile(r'[a-z]+')
+
+
+def name_parts(column):
+    # 'secondary_bedrooms.listings.numberDouble' -> {'bedrooms', 'bedroom', 'numberdouble', ...}
+    parts = set(_NAME_PARTS.findall(re.sub(r'(?<=[a-z])(?=[A-Z])', '_', column).lower()))
+    parts |= {p[:-1] for p in parts if p.endswith('s') and len(p) > 3}
+    return parts - GENERIC_NAME_PARTS
+
+
+def summarise_column(values):
+    # One line on a column's dtype, completeness, cardinality and range or examples
+    dtype = values.dtype
+    count = len(values)
+    sample = values.sample(SUMMARY_SAMPLE_ROWS, random_state=0) if count > SUMMARY_SAMPLE_ROWS else values
+    non_null = sample.notna()
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        # preprocess_data fills missing numbers with 0
+        non_null &= sample != 0
+    parts = [str(dtype), f"{non_null.mean():.0%} filled" if count else "empty"]
+    present = sample[non_null]
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == object or pd.api.types.is_string_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        texts = present.map(lambda v: v if isinstance(v, str) else str(v)) if dtype == object else present.astype(str)
+        distinct = texts.nunique()
+        parts.append(f"{distinct}{'+' if count > len(sample) and distinct > LOW_CARDINALITY else ''} distinct")
+        examples = texts.value_counts().index[:MAX_TOP_VALUES if distinct <= LOW_CARDINALITY else 2]
+        if len(examples):
+            parts.append('e.g. ' + ', '.join(repr(e[:40]) for e in examples))
+    elif len(present) and pd.api.types.is_datetime64_any_dtype(dtype):
+        parts.append(f"{present.min():%Y-%m-%d} to {present.max():%Y-%m-%d}")
+    elif len(present) and pd.api.types.is_numeric_dtype(dtype):
+        low, median, high = np.percentile(present.to_numpy(dtype=np.float64), [0, 50, 100])
+        parts.append(f"min {low:.4g}, median {median:.4g}, max {high:.4g}")
+    return ', '.join(parts)
+
+
+class AnalysisPromptBuilder:
+    # Builds the code-generation prompt from the loaded DataFrame instead of
+    # sample rows and a fixed column list. Only the columns the query is
+    # about are described, each in one line (see summarise_column); they are
+    # picked by keyword and, when an LLMHandler is given, by embedding
+    # similarity between the query and the column descriptions.
+
+    def __init__(self, df, llm_handler=None, max_columns=DEFAULT_MAX_COLUMNS, min_similarity=MIN_SIMILARITY):
+        self.llm_handler = llm_handler
+        self.max_columns = max_columns
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.prompt_chars = 0
+        self.build_seconds = 0.0
+        self.reload(df)
+
+    def reload(self, df):
+        with self._lock:
+            self.df = df
+            self.columns = list(df.columns)
+            self.parts = {col: name_parts(col) for col in self.columns}
+            self._summaries = {}
+            self._embeddings = None
+
+    def summary(self, column):
+        summary = self._summaries.get(column)
+        if summary is None:
+            summary = self._summaries[column] = summarise_column(self.df[column])
+        return summary
+
+    def _column_embeddings(self):
+        # Unit vectors for "column name: summary", encoded once per DataFrame
+        if self._embeddings is None:
+            texts = [f"{col.replace('_', ' ').replace('.', ' ')}: {self.summary(col)}" for col in self.columns]
+            embeddings = self.llm_handler.encode_queries(texts)
+            embeddings = np.asarray(embeddings.cpu().numpy() if hasattr(embeddings, 'cpu') else embeddings, dtype=np.float32)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            self._embeddings = embeddings / np.where(norms > 0, norms, 1)
+        return self._embeddings
+
+    def _keyword_scores(self, query, parameters):
+        words = [w for w in _WORDS.findall(normalise_query(query)) if len(w) > 2]
+        for key, value in (parameters or {}).items():
+            words += _WORDS.findall(str(key).lower())
+        scores = dict.fromkeys(self.columns, 0.0)
+        for word in words:
+            stems = {word, word[:-1]} if word.endswith('s') and len(word) > 3 else {word}
+            prefixes = KEYWORD_COLUMNS.get(word, [])
+            for col in self.columns:
+                if stems & self.parts[col]:
+                    scores[col] += 1.0
+                if any(col.startswith(prefix) for prefix in prefixes):
+                    scores[col] += 1.0
+        # Parameter values such as 'Camden' or 'flat' point at the column holding them
+        values = {str(v).lower() for v in (parameters or {}).values() if isinstance(v, (str, int, float)) and not isinstance(v, bool)}
+        if values:
+            for col in self.columns:
+                # Only columns already summarised, so a prompt never scans the whole frame
+                summary = self._summaries.get(col, '').lower()
+                if any(f"'{v}'" in summary for v in values):
+                    scores[col] += 2.0
+        return scores
+
+    def select_columns(self, query, parameters=None):
+        scores = self._keyword_scores(query, parameters)
+        selected = [c for c in CORE_COLUMNS if c in scores]
+        for col in sorted(self.columns, key=lambda c: -scores[c]):
+            if scores[col] <= 0 or len(selected) >= self.max_columns:
+                break
+            if col not in selected:
+                selected.append(col)
+        if self.llm_handler is not None and len(selected) < self.max_columns:
+            try:
+                embeddings = self._column_embeddings()
+                query_embedding = self.llm_handler.encode_query(query)
+                query_embedding = np.asarray(query_embedding.cpu().numpy() if hasattr(query_embedding, 'cpu') else query_embedding,
+                                             dtype=np.float32).reshape(-1)
+                similarity = embeddings @ (query_embedding / max(np.linalg.norm(query_embedding), 1e-12))
+                for i in np.argsort(-similarity):
+                    if similarity[i] < self.min_similarity or len(selected) >= self.max_columns:
+                        break
+                    if self.columns[i] not in selected:
+                        selected.append(self.columns[i])
+            except Exception as e:
+                logging.warning(f"Column embeddings unavailable, using keyword matches only: {str(e)}")
+        return selected
+
+    def build(self, query, parameters=None):
+        start = time.perf_counter()
+        with self._lock:
+            columns = self.select_columns(query, parameters)
+            schema = '\n'.join(f"- {col}: {self.summary(col)}" for col in columns)
+            rows = len(self.df)
+        prompt = f"""Write Python code for this analysis of UK property data: "{query}"
+Interpreted parameters: {parameters or {}}
+
+A pandas DataFrame `df` with {rows} rows is already loaded; do not read any files. Relevant columns (dtype, share filled, distinct values or range):
+{schema}
+
+Notes:
+- Use df['column'] for every column, names contain dots.
+- Missing numbers are 0, so exclude zeros from prices and other measures.
+- datetime columns are already parsed (UTC); use .dt.year, .dt.quarter or .dt.to_period directly.
+- Print the results with print(). Draw plots with matplotlib and leave the figures open; they are captured automatically, so do not save them to files.
+- Return only the code."""
+        seconds = time.perf_counter() - start
+        self.prompts += 1
+        self.prompt_chars += len(prompt)
+        self.build_seconds += seconds
+        logging.info(f"Analysis prompt: {len(prompt)} chars, {len(columns)} of {len(self.columns)} columns, "
+                     f"built in {seconds * 1000:.1f}ms")
+        return prompt
+
+    def stats(self):
+        return {
+            'prompts': self.prompts,
+            'mean_prompt_chars': round(self.prompt_chars / self.prompts) if self.prompts else 0,
+            'mean_build_ms': round(self.build_seconds / self.prompts * 1000, 2) if self.prompts else 0.0,
+            'summarised_columns': len(self._summaries),
+        }
@@ -0,0 +1,190 @@
+import re
+
+from src.filters import parse_amount
+from src.geo_index import parse_distance
+
+# Location columns whose values the local interpreter recognises by name
+KNOWN_LOCATION_COLUMNS = ['town', 'district', 'district_name', 'region']
+
+SEARCH_WORDS = {
+    'find', 'show', 'search', 'list', 'get', 'looking', 'look', 'buy', 'want', 'need', 'available',
+}
+ANALYSIS_WORDS = {
+    'analyze', 'analyse', 'analysis', 'trend', 'trends', 'average', 'avg', 'mean', 'median', 'compare',
+    'comparison', 'distribution', 'plot', 'chart', 'graph', 'statistics', 'stats', 'time', 'per', 'yearly',
+    'quarter', 'quarterly', 'monthly', 'change', 'changes', 'changed', 'count', 'counts', 'how', 'many',
+    'growth', 'visualize', 'visualise', 'breakdown', 'number', 'total', 'mix', 'share',
+}
+PROPERTY_TYPE_WORDS = {
+    'house': 'house', 'houses': 'house', 'flat': 'flat', 'flats': 'flat', 'apartment': 'flat',
+    'apartments': 'flat', 'bungalow': 'bungalow', 'bungalows': 'bungalow', 'maisonette': 'flat',
+    'maisonettes': 'flat', 'detached': 'detached', 'terraced': 'terrace', 'terrace': 'terrace',
+}
+TENURE_WORDS = {'freehold': 'freehold', 'leasehold': 'leasehold'}
+# Words like 'last', 'new', 'cheap' and 'affordable' are left out on purpose:
+# they narrow the query in ways the rules here can't express, so it goes to Gemini
+FILLER_WORDS = {
+    'a', 'an', 'the', 'in', 'at', 'near', 'around', 'of', 'for', 'with', 'and', 'or', 'me', 'i', 'my', 'all',
+    'some', 'any', 'please', 'kindly', 'can', 'you', 'could', 'would', 'to', 'by', 'on', 'from', 'over',
+    'property', 'properties', 'home', 'homes', 'sale', 'sold', 'sales', 'prices', 'price', 'sale_price', 'what',
+    'is', 'are', 'was', 'were', 'which', 'there', 'each', 'every', 'year', 'years', 'month', 'months',
+    'type', 'types', 'tenure', 'district', 'districts', 'town', 'towns', 'region', 'regions', 'area', 'areas',
+    'since', 'between', 'during', 'across', 'vs', 'versus', 'that', 'this', 'these', 'those',
+    'room', 'rooms', 'bed', 'beds', 'bedroom', 'bedrooms', 'nearby', 'close',
+}
+
+_BEDROOMS = re.compile(r'\b(\d{1,2})\s*(bhk|rk|beds?|bedrooms?)\b')
+# A number followed by one of these is a duration, distance or size, never a price
+_NOT_PRICE = (r'(?!\s*(?:(?:years?|yrs?|months?|weeks?|days?|hours?|hrs?|minutes?|mins?|km|kms|kilomet(?:re|er)s?'
+              r'|miles?|mi|metres?|meters?|sq|square|ft|feet|percent)\b|%))')
+_AMOUNT = r'£?\s*(\d[\d,]*(?:\.\d+)?\s*(?:k|m|mn|million|thousand)?)\b' + _NOT_PRICE
+_PRICE_BETWEEN = re.compile(r'\bbetween\s+' + _AMOUNT + r'\s*(?:and|to|-)\s*' + _AMOUNT)
+_PRICE_RANGE = re.compile(r'£\s*(\d[\d,]*(?:\.\d+)?\s*(?:k|m|mn|million|thousand)?)\s*(?:-|to)\s*' + _AMOUNT)
+_PRICE_MAX = re.compile(r'\b(?:under|below|less than|up to|upto|max|maximum|within|cheaper than|budget(?: of)?)\s+' + _AMOUNT)
+_PRICE_MIN = re.compile(r'\b(?:over|above|more than|at least|min|minimum|from)\s+' + _AMOUNT)
+# Smallest amount read as a price without a £ sign or k/m suffix; "over 10"
+# could as well be a count or a duration
+MIN_BARE_PRICE = 1000
+_YEAR = re.compile(r'\b(19[5-9]\d|20\d{2})\b')
+_DISTANCE = re.compile(r'\bwithin\s+(\d+(?:\.\d+)?\s*(?:km|kms|kilomet(?:re|er)s?|miles?|mi|metres?|meters?|m))\s+(?:of|from)\b')
+_POSTCODE = re.compile(r'\b([a-z]{1,2}\d[a-z\d]?\s*\d[a-z]{2})\b')
+_NEAR = re.compile(r'\b(?:near|nearby|close to)\b')
+_PUNCTUATION = re.compile(r"[^\w£.\-\s]")
+
+
+def normalise_query(query):
+    # Canonical form used as the interpretation cache key
+    text = re.sub(r'(\d),(?=\d{3}\b)', r'\1', str(query).lower())
+    text = _PUNCTUATION.sub(' ', text)
+    text = re.sub(r'(\d)\s+(bhk|rk)\b', r'\1\2', text)
+    words = [w.strip('.-') for w in text.split()]
+    return ' '.join(w for w in words if w and w not in ('please', 'kindly'))
+
+
+def known_locations(df):
+    # Lower-cased place name -> name as written in the data
+    locations = {}
+    for col in KNOWN_LOCATION_COLUMNS:
+        if col in df.columns:
+            for value in df[col].dropna().astype(str).unique():
+                name = value.strip()
+                if name:
+                    locations.setdefault(name.lower(), name)
+    return locations
+
+
+class LocalQueryInterpreter:
+    # Rule-based interpreter for common, unambiguous queries. interpret()
+    # returns None whenever any word is left unexplained, so everything it is
+    # not sure about still goes to Gemini.
+
+    def __init__(self, locations=None, max_location_words=4):
+        self.locations = locations or {}
+        self.max_location_words = max_location_words
+
+    def _take(self, pattern, text, handler):
+        def replace(match):
+            handler(match)
+            return ' '
+        return pattern.sub(replace, text)
+
+    def interpret(self, query):
+        text = normalise_query(query)
+        parameters = {}
+        ambiguous = []
+
+        def bedrooms(match):
+            parameters['bedrooms'] = int(match.group(1))
+
+        def price(match, group):
+            amount = parse_amount(match.group(group))
+            if amount < MIN_BARE_PRICE and '£' not in match.group(0):
+                ambiguous.append(match.group(0))
+            return amount
+
+        def between(match):
+            low, high = price(match, 1), price(match, 2)
+            parameters['min_price'], parameters['max_price'] = min(low, high), max(low, high)
+
+        def max_price(match):
+            parameters['max_price'] = price(match, 1)
+
+        def min_price(match):
+            parameters['min_price'] = price(match, 1)
+
+        # Years go first so "from 2015" is not read as a price
+        years = sorted(int(y) for y in _YEAR.findall(text))
+        if len(years) == 1:
+            parameters['start_year' if re.search(r'\b(since|after|from)\s+' + str(years[0]), text) else 'year'] = years[0]
+        elif len(years) >= 2:
+            parameters['start_year'], parameters['end_year'] = years[0], years[-1]
+        text = _YEAR.sub(' ', text)
+
+        def distance(match):
+            parameters['distance'] = f"{parse_distance(match.group(1)):g} km"
+
+        def postcode(match):
+            code = match.group(1).replace(' ', '').upper()
+            parameters['postcode'] = f"{code[:-3]} {code[-3:]}"
+
+        # Distances before prices, so "within 2 km" is not read as a budget
+        near = bool(_NEAR.search(text))
+        text = self._take(_DISTANCE, text, distance)
+        text = self._take(_POSTCODE, text, postcode)
+        text = self._take(_BEDROOMS, text, bedrooms)
+        text = self._take(_PRICE_BETWEEN, text, between)
+        text = self._take(_PRICE_RANGE, text, between)
+        text = self._take(_PRICE_MAX, text, max_price)
+        text = self._take(_PRICE_MIN, text, min_price)
+        if ambiguous:
+            return None
+
+        words = text.split()
+        remaining = []
+        i = 0
+        while i < len(words):
+            # Longest known place name starting at this word
+            for size in range(min(self.max_location_words, len(words) - i), 0, -1):
+                name = ' '.join(words[i:i + size])
+                if name in self.locations and name not in FILLER_WORDS:
+                    if parameters.setdefault('location', self.locations[name]) != self.locations[name]:
+                        return None  # "Camden vs Hackney" compares places, which needs Gemini
+                    i += size
+                    break
+            else:
+                remaining.append(words[i])
+                i += 1
+
+        if near or 'distance' in parameters:
+            # The place or postcode is a point to measure from rather than a filter
+            anchor = parameters.pop('postcode', None) or parameters.pop('location', None)
+            if anchor is None:
+                return None
+            parameters['near'] = anchor
+
+        wants_search = wants_analysis = False
+        for word in remaining:
+            # A second, different type or tenure ("flats and houses") is declined
+            # rather than dropped, as is a second place above
+            if word in PROPERTY_TYPE_WORDS:
+                if parameters.setdefault('property_type', PROPERTY_TYPE_WORDS[word]) != PROPERTY_TYPE_WORDS[word]:
+                    return None
+            elif word in TENURE_WORDS:
+                if parameters.setdefault('tenure', TENURE_WORDS[word]) != TENURE_WORDS[word]:
+                    return None
+            elif word in SEARCH_WORDS:
+                wants_search = True
+            elif word in ANALYSIS_WORDS:
+                wants_analysis = True
+            elif word not in FILLER_WORDS:
+                # Including stray numbers, as in "last 5 years"; bedrooms, prices,
+                # years and distances have already been taken out above
+                return None
+
+        if wants_analysis and not wants_search:
+            intent = 'analysis'
+        elif not wants_analysis and (wants_search or {'bedrooms', 'min_price', 'max_price', 'property_type', 'near'} & parameters.keys()):
+            intent = 'search'
+        else:
+            return None
+        return {'intent': intent, 'parameters': parameters}
@@ -1,21 +1,133 @@
+import logging
+import threading
+
+import numpy as np
 import pandas as pd
+from src.embedding_cache import EmbeddingCache
+from src.filters import PropertyFilter
+from src.geo_index import (ANCHOR_FALLBACK_KEYS, NEAR_CANDIDATES, GeoIndex, parse_bbox, postcode_fallbacks,
+                            split_parameters)
+from src.metrics import metrics
+from src.vector_index import build_index, index_nbytes
 
 class SearchEngine:
-    def __init__(self, df, llm_handler):
-        self.df = df
+    def __init__(self, df, llm_handler, embedding_cache=None, data_version=None, index_kind='exact', index_params=None):
         self.llm_handler = llm_handler
-        try:
-            self.property_embeddings = self.llm_handler.encode_properties(df)
-        except Exception as e:
-            print(f"Error encoding properties: {str(e)}")
-            self.property_embeddings = None
+        self.index_kind = index_kind
+        self.index_params = index_params or {}
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache()
+        self.data_version = None
+        # Reloads run one at a time and build the new state aside, so searches
+        # keep using the old state until it is swapped in under _lock
+        self._reload_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.reload(df, data_version)
 
-    def search(self, query, parameters, top_k=5):
-        if self.property_embeddings is None:
-            return pd.DataFrame()  # Return an empty DataFrame if encoding failed
-        
+    def reload(self, df, data_version=None):
+        # Only new or changed rows are re-encoded; embeddings are realigned to df's row order
+        with self._reload_lock:
+            if data_version is not None and data_version == self.data_version:
+                return  # Another session already loaded this version
+            filters = PropertyFilter(df)
+            geo = GeoIndex.from_frame(df)
+            try:
+                property_embeddings = self.embedding_cache.get_or_build(df, self.llm_handler)
+                index = build_index(property_embeddings, self.index_kind, **self.index_params)
+            except Exception as e:
+                print(f"Error encoding properties: {str(e)}")
+                property_embeddings = index = None
+            with self._lock:
+                self.df, self.filters, self.geo = df, filters, geo
+                self.property_embeddings, self.index = property_embeddings, index
+                self.data_version = data_version
+            if index is not None:
+                logging.info(f"Search index: {self.memory_stats()}")
+
+    def memory_stats(self):
+        # In-memory size of the index against holding every embedding as float32
+        with self._lock:
+            embeddings, index = self.property_embeddings, self.index
+        if index is None:
+            return {}
+        full_mb = embeddings.nbytes / 1e6
+        index_mb = index_nbytes(index) / 1e6
+        return {'index': self.index_kind, 'index_mb': round(index_mb, 1), 'float32_mb': round(full_mb, 1),
+                'saved_mb': round(full_mb - index_mb, 1)}
+
+    def state(self):
+        # (df, filters, geo, index) of one data version. A search reads it once
+        # and uses it throughout, so candidate row positions from one version
+        # are never applied to another version's index and frame.
+        with self._lock:
+            return self.df, self.filters, self.geo, self.index
+
+    def spatial_candidates(self, state, spatial, candidates=None, fallbacks=()):
+        # Narrows candidates with a bounding box, a radius around an anchor, or,
+        # for an anchor without a distance, its nearest properties. Returns the
+        # rows (None if nothing could be applied) and the anchor point. An anchor
+        # that can't be found falls back to its postcode sector or outward code,
+        # then to the places in fallbacks; if none of them can be found either,
+        # this raises rather than searching everywhere.
+        _, filters, geo, _ = state
+        rows, point = candidates, None
+        bbox = parse_bbox(spatial['bbox']) if spatial['bbox'] is not None else None
+        if bbox is not None:
+            rows = geo.bbox(*bbox) if rows is None else np.intersect1d(rows, geo.bbox(*bbox), assume_unique=True)
+        if spatial['anchor'] is not None:
+            point = geo.resolve_anchor(spatial['anchor'], filters.locate)
+            for anchor in (postcode_fallbacks(spatial['anchor']) + list(fallbacks)) if point is None else []:
+                point = geo.resolve_anchor(anchor, filters.locate)
+                if point is not None:
+                    logging.info(f"Could not locate {spatial['anchor']!r}, searching near {anchor!r} instead")
+                    break
+            if point is None and bbox is None:
+                raise ValueError(f"Could not find {spatial['anchor']!r} to search near; try a town, district or full postcode")
+        if point is not None:
+            if spatial['radius_km'] is not None:
+                nearby = geo.radius(point[0], point[1], spatial['radius_km'])
+                rows = nearby if rows is None else np.intersect1d(rows, nearby, assume_unique=True)
+            else:
+                rows = np.sort(geo.nearest(point[0], point[1], NEAR_CANDIDATES, candidates=rows))
+        return rows, point
+
+    def prepare(self, query, parameters, state=None):
+        # Everything before the query is encoded: the search string plus the
+        # candidate rows and anchor point from the filters and spatial index,
+        # and the state they refer to, which has to be passed on to rank()
+        state = state or self.state()
         # Combine query and parameters into a single search string
         search_string = f"{query} {' '.join([f'{k}:{v}' for k, v in parameters.items()])}"
-        query_embedding = self.llm_handler.encode_query(search_string)
-        top_indices = self.llm_handler.search_properties(query_embedding, self.property_embeddings, top_k)
-        return self.df.iloc[top_indices]
\ No newline at end of file
+        # Distances and anchors go to the spatial index, the rest to the column filters
+        spatial, parameters = split_parameters(parameters)
+        # Hard constraints narrow the rows before similarity ranking
+        candidates = state[1].candidates(parameters)
+        point = None
+        if spatial is not None and (candidates is None or len(candidates)):
+            # Places among the other parameters can stand in for an anchor that isn't in the data
+            fallbacks = [v for k, v in parameters.items() if str(k).strip().lower() in ANCHOR_FALLBACK_KEYS and v]
+            candidates, point = self.spatial_candidates(state, spatial, candidates, fallbacks)
+        return search_string, candidates, point, state
+
+    def rank(self, state, query_embedding, candidates, point=None, top_k=5):
+        df, _, geo, index = state
+        if candidates is not None and len(candidates) == 0:
+            return df.iloc[[]]
+        with metrics.span('vector_search'):
+            top_indices = self.llm_handler.search_properties(query_embedding, index, top_k, candidates=candidates)
+        results = df.iloc[top_indices]
+        if point is not None:
+            results = results.assign(distance_km=np.round(geo.distances(point[0], point[1], top_indices), 2))
+        return results
+
+    def search(self, query, parameters, top_k=5):
+        state = self.state()
+        if state[3] is None:
+            return pd.DataFrame()  # Return an empty DataFrame if encoding failed
+
+        with metrics.span('filter'):
+            search_string, candidates, point, state = self.prepare(query, parameters, state)
+        if candidates is not None and len(candidates) == 0:
+            return state[0].iloc[[]]
+        with metrics.span('encode_query'):
+            query_embedding = self.llm_handler.encode_query(search_string)
+        return self.rank(state, query_embedding, candidates, point, top_k)
@@ -0,0 +1,459 @@
+import argparse
+import asyncio
+import base64
+import csv
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import metrics
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8600
+# Columns returned for each search hit; the rest of the row stays server-side
+RESULT_COLUMNS = ['address', 'postcode', 'town', 'district', 'region', 'latest_sale_price',
+                  'latest_tenure', 'secondary_property_type.epc', 'lat', 'long', 'distance_km']
+MAX_BODY_BYTES = 1 << 20
+
+
+class QueryBatcher:
+    # Collects encode requests arriving within max_wait_ms of each other (up to
+    # max_batch) and encodes them in one model forward pass.
+
+    def __init__(self, llm_handler, executor, max_batch=64, max_wait_ms=5):
+        self.llm_handler = llm_handler
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.queries = 0
+        self._queue = None
+        self._worker = None
+
+    async def encode(self, text):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                with metrics.span('encode_batch', size=len(texts)):
+                    embeddings = await loop.run_in_executor(self.executor, self.llm_handler.encode_queries, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(embeddings[i])
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'mean_batch_size': self.queries / self.batches if self.batches else 0.0,
+        }
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+
+class QueryService:
+    # Headless front end over the same handlers the Streamlit app uses.
+    # Searches encode their query through the micro-batcher; Gemini calls run
+    # in threads, at most max_gemini_calls at a time, retried with exponential
+    # backoff. Used directly from asyncio code or through serve_http().
+
+    def __init__(self, df, gemini_handler, llm_handler, search_engine, max_gemini_calls=8, retries=3,
+                 backoff=1.0, max_batch=64, max_wait_ms=5):
+        self.df = df
+        self.gemini_handler = gemini_handler
+        self.llm_handler = llm_handler
+        self.search_engine = search_engine
+        self.retries = retries
+        self.backoff = backoff
+        # Gemini calls block, so each gets a thread; the model gets one of its own
+        self.gemini_executor = ThreadPoolExecutor(max_gemini_calls, thread_name_prefix='gemini')
+        self.model_executor = ThreadPoolExecutor(1, thread_name_prefix='encode')
+        self.batcher = QueryBatcher(llm_handler, self.model_executor, max_batch, max_wait_ms)
+        self.max_gemini_calls = max_gemini_calls
+        self._gemini_slots = None
+        self.gemini_calls = 0
+        self.gemini_retries = 0
+        self.gemini_failures = 0
+        metrics.register('service', self.stats)
+
+    @classmethod
+    def from_files(cls, data_file, api_key, **options):
+        from src import data_store
+        from src.aggregate_cube import AggregateCube
+        from src.analysis_pool import AnalysisPool
+        from src.code_cache import AnalysisCodeCache
+        from src.gemini_handler import GeminiHandler
+        from src.llm_handler import LLMHandler
+        from src.prompt_builder import AnalysisPromptBuilder
+        from src.query_parser import known_locations
+        from src.search_engine import SearchEngine
+
+        with metrics.span('data_load'):
+            df = data_store.load_or_ingest(data_file)
+        data_version = os.path.getmtime(data_file) if os.path.isfile(data_file) else None
+        # Workers start from a forkserver and map the store when there is one;
+        # otherwise they are forked, the first ones before the model's threads start
+        store = None if data_store.is_stale(data_file) else (data_store.DEFAULT_STORE_PATH, list(df.columns))
+        analysis_pool = AnalysisPool(df, store=store)
+        gemini_handler = GeminiHandler(api_key, locations=known_locations(df))
+        gemini_handler.analysis_pool = analysis_pool
+        llm_handler = LLMHandler()
+        search_engine = SearchEngine(df, llm_handler, data_version=data_version)
+        gemini_handler.code_cache = AnalysisCodeCache(llm_handler=llm_handler)
+        gemini_handler.aggregate_cube = AggregateCube(df)
+        gemini_handler.prompt_builder = AnalysisPromptBuilder(df, llm_handler=llm_handler)
+        return cls(df, gemini_handler, llm_handler, search_engine, **options)
+
+    async def _call_gemini(self, func, *args):
+        if self._gemini_slots is None:
+            self._gemini_slots = asyncio.Semaphore(self.max_gemini_calls)
+        loop = asyncio.get_running_loop()
+        async with self._gemini_slots:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.gemini_calls += 1
+                    return await loop.run_in_executor(self.gemini_executor, func, *args)
+                except Exception as e:
+                    # Bad code or an unparseable answer would fail the same way again
+                    if attempt == self.retries or not is_transient(e):
+                        self.gemini_failures += 1
+                        raise
+                    delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+                    self.gemini_retries += 1
+                    logging.warning(f"Gemini call failed ({str(e)}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    async def interpret(self, query):
+        # Cached and locally interpretable queries never wait for a Gemini slot
+        interpretation = self.gemini_handler.interpret_locally(query)
+        if interpretation is not None:
+            return interpretation
+        return await self._call_gemini(self.gemini_handler.interpret_remotely, query)
+
+    async def search(self, query, parameters=None, top_k=5):
+        if parameters is None:
+            interpretation = await self.interpret(query)
+            parameters = interpretation.get('parameters', {})
+        engine = self.search_engine
+        # One snapshot for the whole search, as a reload may land while the query is being encoded
+        state = engine.state()
+        if state[3] is None:
+            raise RuntimeError("Search index is not available")
+        with metrics.span('filter'):
+            search_string, candidates, point, state = engine.prepare(query, parameters, state)
+        if candidates is not None and len(candidates) == 0:
+            return state[0].iloc[[]]
+        # Includes the wait for the rest of the batch
+        with metrics.span('encode_query'):
+            query_embedding = await self.batcher.encode(search_string)
+        return engine.rank(state, query_embedding, candidates, point, top_k)
+
+    async def analyse(self, query, parameters=None):
+        if parameters is None:
+            parameters = (await self.interpret(query)).get('parameters', {})
+        # Analyses the aggregate cube covers never wait for a Gemini slot
+        result = await asyncio.get_running_loop().run_in_executor(None, self.gemini_handler.analyse_locally, query, parameters)
+        if result is not None:
+            return result
+        return await self._call_gemini(self.gemini_handler.analyse_remotely, query, parameters, self.df)
+
+    async def handle(self, query, top_k=5):
+        # Interprets a query and runs it as a search or an analysis
+        interpretation = await self.interpret(query)
+        response = {'query': query, 'intent': interpretation.get('intent'), 'parameters': interpretation.get('parameters', {})}
+        if response['intent'] == 'search':
+            response['results'] = records(await self.search(query, response['parameters'], top_k))
+        elif response['intent'] == 'analysis':
+            response.update(analysis_response(await self.analyse(query, response['parameters'])))
+        return response
+
+    def handle_profiled(self, query, top_k=5):
+        # handle() run start to finish in the calling thread under cProfile, so
+        # the profile sees every stage; the query is encoded on its own rather
+        # than batched, and Gemini calls skip the retry and concurrency limits
+        with metrics.profile('query') as report:
+            interpretation = self.gemini_handler.interpret_query(query)
+            response = {'query': query, 'intent': interpretation.get('intent'), 'parameters': interpretation.get('parameters', {})}
+            if response['intent'] == 'search':
+                response['results'] = records(self.search_engine.search(query, response['parameters'], top_k))
+            elif response['intent'] == 'analysis':
+                result = self.gemini_handler.generate_and_execute_analysis(query, response['parameters'], self.df)
+                response.update(analysis_response(result))
+        response['profile'] = report
+        return response
+
+    async def bulk_search(self, queries, top_k=5, concurrency=256, progress_every=1000):
+        # Resolves many search queries; duplicates are answered once. Yields
+        # responses in input order, errors included per query.
+        unique = list(dict.fromkeys(queries))
+        slots = asyncio.Semaphore(concurrency)
+        start = time.perf_counter()
+        done = 0
+
+        async def run(query):
+            nonlocal done
+            async with slots:
+                try:
+                    interpretation = await self.interpret(query)
+                    response = {'query': query, 'intent': interpretation.get('intent'),
+                                'parameters': interpretation.get('parameters', {})}
+                    if response['intent'] != 'search':
+                        response['error'] = "Not a search query"
+                    else:
+                        response['results'] = records(await self.search(query, response['parameters'], top_k))
+                except Exception as e:
+                    response = {'query': query, 'error': str(e)}
+            done += 1
+            if progress_every and done % progress_every == 0:
+                logging.info(f"Bulk search: {done}/{len(unique)} queries, {done / (time.perf_counter() - start):.0f}/s")
+            return response
+
+        responses = dict(zip(unique, await asyncio.gather(*(run(q) for q in unique))))
+        logging.info(f"Bulk search resolved {len(queries)} queries ({len(unique)} unique) in {time.perf_counter() - start:.1f}s")
+        return [responses[q] for q in queries]
+
+    async def bulk_search_file(self, path, output=None, top_k=5, concurrency=256):
+        responses = await self.bulk_search(read_queries(path), top_k, concurrency)
+        if output:
+            with open(output, 'w', encoding='utf-8') as f:
+                for response in responses:
+                    f.write(json.dumps(response, default=str) + '\n')
+        return responses
+
+    def stats(self):
+        return {
+            'encode_batches': self.batcher.stats(),
+            'gemini': {'calls': self.gemini_calls, 'retries': self.gemini_retries, 'failures': self.gemini_failures},
+            **self.gemini_handler.pipeline_stats(),
+        }
+
+    async def close(self):
+        await self.batcher.close()
+        self.gemini_executor.shutdown(wait=False)
+        self.model_executor.shutdown(wait=False)
+        if self.gemini_handler.analysis_pool is not None:
+            self.gemini_handler.analysis_pool.close()
+
+
+def records(results):
+    # Search hits as JSON-ready dicts
+    columns = [c for c in RESULT_COLUMNS if c in results.columns]
+    return json.loads(results[columns].to_json(orient='records', date_format='iso'))
+
+
+# google.api_core exceptions worth retrying (5xx, 429 and timeouts), matched by name
+# so the service doesn't import the Gemini client; the handler chains them as the cause
+TRANSIENT_ERRORS = {'ServerError', 'TooManyRequests', 'ResourceExhausted', 'DeadlineExceeded', 'RetryError'}
+
+
+def is_transient(error):
+    # True if the error, or one it was raised from, is a network or API error a retry may clear
+    while error is not None:
+        if isinstance(error, (ConnectionError, TimeoutError)):
+            return True
+        if any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def analysis_response(result):
+    # The JSON-ready part of an analysis result; figures are base64 encoded
+    return {
+        'output': result.get('output', ''),
+        'code': result.get('code', ''),
+        'figure_format': result.get('figure_format', 'png'),
+        'figures': [base64.b64encode(f).decode() for f in result.get('figures', [])],
+    }
+
+
+def read_queries(path):
+    # One query per line (.txt), a 'query' field per line (.jsonl) or a 'query' column (.csv)
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            return [row['query'] for row in csv.DictReader(f) if row.get('query')]
+        if path.endswith(('.jsonl', '.ndjson')):
+            return [json.loads(line)['query'] for line in f if line.strip()]
+        return [line.strip() for line in f if line.strip()]
+
+
+async def _respond(writer, status, payload):
+    # Strings are sent as plain text (the Prometheus exposition format), everything else as JSON
+    if isinstance(payload, str):
+        body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+    else:
+        body, content_type = json.dumps(payload, default=str).encode('utf-8'), 'application/json'
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 415: 'Unsupported Media Type', 500: 'Internal Server Error'}[status]
+    writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    writer.close()
+
+
+async def _handle_http(service, reader, writer):
+    # Minimal JSON-over-HTTP endpoint:
+    #   POST /search   {"query": ..., "parameters": {...}?, "top_k": 5}
+    #   POST /query    {"query": ..., "profile": false}   interpret, then search or analyse;
+    #                  with "profile": true the request runs under cProfile
+    #   POST /interpret {"query": ...}
+    #   POST /bulk     {"queries": [...], "top_k": 5}   results come back in the response
+    #   GET  /stats    JSON, including per-stage latencies
+    #   GET  /metrics  Prometheus text
+    # POST bodies must be sent as application/json, so a browser can't make a
+    # cross-site request without a CORS preflight, which this server never allows.
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) < 2:
+            return await _respond(writer, 400, {'error': "Malformed request"})
+        method, path = request_line[0], request_line[1]
+        length = 0
+        content_type = ''
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+            elif name.strip().lower() == 'content-type':
+                content_type = value.split(';')[0].strip().lower()
+        if method == 'POST' and content_type != 'application/json':
+            return await _respond(writer, 415, {'error': "POST bodies must be application/json"})
+        if length > MAX_BODY_BYTES:
+            return await _respond(writer, 413, {'error': "Request body too large"})
+        body = json.loads(await reader.readexactly(length)) if length else {}
+        if not isinstance(body, dict):
+            return await _respond(writer, 400, {'error': "Request body must be a JSON object"})
+
+        if method == 'GET' and path == '/stats':
+            return await _respond(writer, 200, dict(service.stats(), pipeline=metrics.summary(collect=False)))
+        if method == 'GET' and path == '/metrics':
+            return await _respond(writer, 200, metrics.prometheus())
+        if method != 'POST' or path not in ('/search', '/query', '/interpret', '/bulk'):
+            return await _respond(writer, 404, {'error': f"No route for {method} {path}"})
+        top_k = int(body.get('top_k', 5))
+        if path == '/bulk':
+            # Queries inline only; reading and writing files is left to the bulk CLI command
+            queries = body['queries']
+            if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+                raise ValueError("'queries' must be a list of strings")
+            responses = await service.bulk_search(queries, top_k)
+            return await _respond(writer, 200, {'queries': len(responses), 'responses': responses})
+        query = body['query']
+        if path == '/interpret':
+            return await _respond(writer, 200, await service.interpret(query))
+        if path == '/search':
+            results = await service.search(query, body.get('parameters'), top_k)
+            return await _respond(writer, 200, {'query': query, 'results': records(results)})
+        if body.get('profile'):
+            response = await asyncio.get_running_loop().run_in_executor(None, service.handle_profiled, query, top_k)
+            return await _respond(writer, 200, response)
+        return await _respond(writer, 200, await service.handle(query, top_k))
+    except (KeyError, ValueError) as e:
+        await _respond(writer, 400, {'error': str(e)})
+    except Exception as e:
+        logging.exception("Request failed")
+        await _respond(writer, 500, {'error': str(e)})
+
+
+async def serve_http(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = await asyncio.start_server(lambda r, w: _handle_http(service, r, w), host, port)
+    logging.info(f"Query service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def _api_key():
+    if os.environ.get('GEMINI_API_KEY'):
+        return os.environ['GEMINI_API_KEY']
+    # Same secret the Streamlit app reads
+    secrets_path = os.path.join('.streamlit', 'secrets.toml')
+    if os.path.isfile(secrets_path):
+        try:
+            import tomllib
+        except ImportError:
+            return None  # Python < 3.11
+        with open(secrets_path, 'rb') as f:
+            return tomllib.load(f).get('GEMINI_API_KEY')
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless query service over the search and analysis handlers.")
+    parser.add_argument('--data', default='data/property_data.csv')
+    parser.add_argument('--max-gemini-calls', type=int, default=8)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--metrics-events', help="Append every timed pipeline stage to this JSON-lines file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help="Serve the JSON HTTP API")
+    serve_parser.add_argument('--host', default=DEFAULT_HOST)
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+
+    bulk_parser = subparsers.add_parser('bulk', help="Resolve every search query in a file")
+    bulk_parser.add_argument('queries', help=".txt (one per line), .jsonl or .csv with a 'query' field")
+    bulk_parser.add_argument('--output', default='bulk_results.jsonl')
+    bulk_parser.add_argument('--top-k', type=int, default=5)
+    bulk_parser.add_argument('--concurrency', type=int, default=256)
+    args = parser.parse_args(argv)
+
+    api_key = _api_key()
+    if not api_key:
+        parser.error("Set GEMINI_API_KEY or add it to .streamlit/secrets.toml")
+    metrics.events_path = args.metrics_events
+    service = QueryService.from_files(args.data, api_key, max_gemini_calls=args.max_gemini_calls, retries=args.retries)
+
+    async def run():
+        try:
+            if args.command == 'serve':
+                await serve_http(service, args.host, args.port)
+            else:
+                responses = await service.bulk_search_file(args.queries, args.output, args.top_k, args.concurrency)
+                failed = sum(1 for r in responses if 'error' in r)
+                print(f"Wrote {len(responses)} responses to {args.output} ({failed} without results)")
+                print(json.dumps(service.stats(), default=str))
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()